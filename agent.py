@@ -1,32 +1,212 @@
 # agent.py
-from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
-from langchain_google_genai import ChatGoogleGenerativeAI
-from tools import *
+from tools import (
+    find_files_from_sentry_issue,
+    search_github,
+    prune_sentry_event,
+    create_daytona_workspace_with_fix,
+    create_draft_pr,
+)
+from providers import register_provider, get_provider
+from tracing import span, traced
+from functools import lru_cache
+import blobstore
+import prompt_cache
+import knowledge_store
+import asyncio
 import json
+import time
 import os
 from typing import TypedDict
 
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash", 
-    temperature=0, 
-    google_api_key=os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
-)
+# The Gemini client and the compiled graph are built on first use and cached for the
+# life of the process, so importing this module (e.g. on every Streamlit rerun) is cheap.
+def _make_llm():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.5-flash", 
+        temperature=0, 
+        google_api_key=os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
+    )
+
+register_provider("llm", _make_llm, replace=False)
+
+class FileEdit(TypedDict):
+    """Complete new content for one file in the repository"""
+    file_path: str  # path relative to the repository root
+    content: str  # full file content after the fix
+
+class FixProposal(TypedDict):
+    """A proposed bug fix, ready to be tested in a sandbox and opened as a PR"""
+    problem: str  # what is wrong
+    solution: str  # how the change fixes it
+    edits: list[FileEdit]  # files to overwrite, with their complete fixed content
+    pr_title: str
+    pr_description: str
+
+# Stable part of the fix prompt; it leads the prompt-prefix cache entry for each repo
+FIX_INSTRUCTIONS = """You are a senior software engineer tasked with fixing a bug. Analyze the error and propose a fix.
+
+TASK:
+1. Analyze the Sentry error to understand what went wrong
+2. Consider the relevant files identified and why they're related to the error
+3. Propose a fix that addresses the root cause
+4. Give the complete fixed content of every file you change
+5. Provide a clear PR title and description
+
+Respond by calling the FixProposal tool. Each edit's file_path is relative to the
+repository root and its content is the entire file after the fix (no markdown fences).
+"""
+
+# Extra attempts allowed when the model's output does not match FixProposal
+MAX_FIX_REPAIRS = 2
+
+def validate_fix_proposal(args) -> FixProposal:
+    """Check and normalize the model's FixProposal; raises ValueError describing the first problem"""
+    if not isinstance(args, dict):
+        raise ValueError("expected a FixProposal object")
+    for field in ("problem", "solution", "pr_title", "pr_description"):
+        if not isinstance(args.get(field), str):
+            raise ValueError(f"'{field}' must be a string")
+    if not args["pr_title"].strip():
+        raise ValueError("'pr_title' must not be empty")
+    edits = args.get("edits")
+    if not isinstance(edits, list) or not edits:
+        raise ValueError("'edits' must be a non-empty list")
+    normalized = []
+    for i, edit in enumerate(edits):
+        if not isinstance(edit, dict):
+            raise ValueError(f"edits[{i}] must be an object with file_path and content")
+        file_path = edit.get("file_path")
+        content = edit.get("content")
+        if not isinstance(file_path, str) or not file_path.strip(" `'\""):
+            raise ValueError(f"edits[{i}].file_path must be a non-empty string")
+        file_path = file_path.strip(" `'\"")
+        if file_path.startswith("/") or ".." in file_path.split("/"):
+            raise ValueError(f"edits[{i}].file_path must be relative to the repository root: {file_path}")
+        if not isinstance(content, str) or not content.strip():
+            raise ValueError(f"edits[{i}].content must contain the complete file")
+        normalized.append({"file_path": file_path, "content": content})
+    return {
+        "problem": args["problem"].strip(),
+        "solution": args["solution"].strip(),
+        "edits": normalized,
+        "pr_title": args["pr_title"].strip(),
+        "pr_description": args["pr_description"].strip(),
+    }
+
+def render_fix_markdown(state: dict) -> str:
+    """Markdown view of the typed fix fields, for the UI"""
+    if not state.get("fix_edits"):
+        return "_No valid fix was proposed._"
+    parts = [
+        f"**PR Title:** {state.get('pr_title', '')}",
+        f"**Problem:**\n{state.get('fix_problem', '')}",
+        f"**Solution:**\n{state.get('fix_solution', '')}",
+    ]
+    for edit in state["fix_edits"]:
+        parts.append(f"**File to Fix:** `{edit['file_path']}`\n```\n{blobstore.get_text(edit['content_ref'])}\n```")
+    parts.append(f"**PR Description:**\n{state.get('pr_description', '')}")
+    return "\n\n".join(parts)
 
+# Large payloads live in the blob store; state only holds their refs so that the
+# checkpointer's per-step snapshots stay small.
 class AgentState(TypedDict):
     error_id: str
-    sentry_data: dict
+    sentry_data: dict  # Sentry event pruned by prune_sentry_event
+    sentry_ref: str  # blob ref of the full Sentry event
     repo_url: str
     workspace_id: str
-    reproduction_steps: str
-    proposed_fix: str
+    reproduction_steps_ref: str  # blob ref of the sandbox output
+    fix_problem: str
+    fix_solution: str
+    fix_edits: list  # [{"file_path": ..., "content_ref": blob ref of the new file content}]
+    pr_title: str
+    pr_description: str
     github_issues: list
     final_pr_url: str
     pr_number: int
     messages: list
     needs_approval: bool
     relevant_files: dict  # Files found by browser_use analysis
+    prior_fix: dict  # closest past investigation from the knowledge store, if any
 
+def build_initial_state(error_id: str, repo_url: str, sentry_event: dict) -> dict:
+    """Initial graph input: the full event goes to the blob store, state keeps the pruned copy"""
+    return {
+        "error_id": error_id,
+        "repo_url": repo_url,
+        "sentry_data": prune_sentry_event(sentry_event),
+        "sentry_ref": blobstore.put_json(sentry_event),
+        "messages": [],
+        "needs_approval": False,
+        "relevant_files": {},  # Will be populated by sentry_analysis_node
+        "prior_fix": {}  # Will be populated by recall_node
+    }
+
+def checkpoint_size(config: dict) -> dict:
+    """Number of checkpoints and total serialized state size for a thread"""
+    app = get_app()
+    serde = app.checkpointer.serde
+    checkpoints = 0
+    total_bytes = 0
+    for snapshot in app.get_state_history(config):
+        checkpoints += 1
+        total_bytes += len(serde.dumps_typed(snapshot.values)[1])
+    return {"checkpoints": checkpoints, "bytes": total_bytes}
+
+def _remember(state, **fields):
+    """Record what this investigation learned; the knowledge store is best effort"""
+    try:
+        knowledge_store.record(state["repo_url"], state["error_id"], state["sentry_data"], **fields)
+    except Exception as e:
+        print(f"Could not update the knowledge store: {e}")
+
+@traced("node.recall")
+def recall_node(state):
+    """Look for a past investigation of a similar error in the knowledge store"""
+    try:
+        matches = knowledge_store.find_similar(state["repo_url"], state["sentry_data"], limit=1)
+    except Exception as e:
+        print(f"Knowledge store lookup failed: {e}")
+        matches = []
+    if not matches:
+        return {"prior_fix": {}}
+    match = matches[0]
+    fix = match["fix"]
+    prior = {
+        "error_id": match["error_id"],
+        "score": match["score"],
+        "verdict": match["verdict"],
+        "pr_url": match["pr_url"],
+        "fix": fix,
+    }
+    reusable = (
+        match["score"] >= knowledge_store.REUSE_SCORE
+        and match["verdict"] == "passed"
+        # Without a stack trace even a close match may be a different bug
+        and knowledge_store.has_frames(state["sentry_data"])
+        and all(blobstore.exists(edit["content_ref"]) for edit in fix.get("edits", []))
+    )
+    if not reusable:
+        return {
+            "prior_fix": {**prior, "reused": False},
+            "messages": [f"Found a similar past issue {match['error_id']} (similarity {match['score']:.2f}); using it as a hint"]
+        }
+    # A verified fix for the same error: skip the browser analysis and the LLM and go
+    # straight to the sandbox, which re-checks it against the current code
+    return {
+        "prior_fix": {**prior, "reused": True},
+        "relevant_files": match["relevant_files"],
+        "fix_problem": fix["problem"],
+        "fix_solution": fix["solution"],
+        "fix_edits": fix["edits"],
+        "pr_title": fix["pr_title"],
+        "pr_description": fix["pr_description"],
+        "needs_approval": True,
+        "messages": [f"♻️ Reusing the verified fix from issue {match['error_id']} (similarity {match['score']:.2f})"]
+    }
+
+@traced("node.sentry_analysis")
 def sentry_analysis_node(state):
     """Analyze Sentry issue and find relevant files using browser_use"""
     repo_url = state["repo_url"]
@@ -40,60 +220,63 @@ def sentry_analysis_node(state):
         "messages": [f"Found {len(files_analysis.get('files', []))} relevant files using browser analysis"]
     }
 
+@traced("node.daytona")
 def daytona_node(state):
     """Run the fixed code in Daytona to verify the fix works"""
     repo_url = state["repo_url"]
-    proposed_fix = state.get("proposed_fix", "")
-    
-    # Extract the file path and fixed code from the proposed fix
-    # This is a simple extraction - in production you might want more robust parsing
-    file_to_fix = None
-    fixed_code = None
-    
-    # Try to extract file path and code from the proposed fix
-    lines = proposed_fix.split("\n")
-    in_code_block = False
-    code_lines = []
+    fix_edits = state.get("fix_edits") or []
     
-    for i, line in enumerate(lines):
-        # Extract file path
-        if "**File to Fix:**" in line:
-            file_to_fix = line.split("**File to Fix:**")[-1].strip()
-        
-        # Extract code block (handle both ```python and ```)
-        if "```" in line:
-            if not in_code_block:
-                # Start of code block
-                in_code_block = True
-                code_lines = []
-            else:
-                # End of code block
-                in_code_block = False
-                if code_lines:
-                    fixed_code = "\n".join(code_lines)
-                    break
-        elif in_code_block:
-            code_lines.append(line)
+    # Nothing valid to test - don't spend a sandbox run on it
+    if not fix_edits:
+        test_output = "❌ No valid fix proposal to test; sandbox run skipped"
+        return {
+            "workspace_id": "",
+            "reproduction_steps_ref": blobstore.put_text(test_output),
+            "messages": [test_output]
+        }
     
     # Create workspace and apply the fix
     workspace_id, test_output = create_daytona_workspace_with_fix(
         repo_url, 
-        file_to_fix=file_to_fix,
-        fixed_code=fixed_code,
-        proposed_fix=proposed_fix
+        edits=[
+            {"file_path": edit["file_path"], "content": blobstore.get_text(edit["content_ref"])}
+            for edit in fix_edits
+        ]
+    )
+    
+    _remember(
+        state,
+        relevant_files=state.get("relevant_files") or {},
+        fix={
+            "problem": state.get("fix_problem", ""),
+            "solution": state.get("fix_solution", ""),
+            "edits": fix_edits,
+            "pr_title": state.get("pr_title", ""),
+            "pr_description": state.get("pr_description", ""),
+        },
+        verdict="passed" if test_output.startswith("✅") else "failed",
     )
+    # A reused fix that no longer passes must not be offered again
+    prior_fix = state.get("prior_fix") or {}
+    if prior_fix.get("reused") and not test_output.startswith("✅"):
+        try:
+            knowledge_store.set_verdict(repo_url, prior_fix["error_id"], "failed")
+        except Exception as e:
+            print(f"Could not update the knowledge store: {e}")
     
     return {
         "workspace_id": workspace_id,
-        "reproduction_steps": test_output,  # This now contains test results
+        "reproduction_steps_ref": blobstore.put_text(test_output),  # This now contains test results
         "messages": [f"Fixed code executed in Daytona. Result: {test_output[:100]}..."]
     }
 
+@traced("node.research")
 def research_node(state):
     query = state["sentry_data"]["exception"]["values"][0]["type"]
     issues = asyncio.run(search_github(state["repo_url"].split("github.com/")[1], query))  # ← just add asyncio.run
     return {"github_issues": issues}
 
+@traced("node.propose_fix")
 def propose_fix_node(state):
     """Use Gemini to analyze the error and relevant files to propose a fix"""
     
@@ -124,9 +307,7 @@ def propose_fix_node(state):
     if not error_message and 'message' in sentry_data:
         error_message = sentry_data.get('message', '')
     
-    prompt = f"""You are a senior software engineer tasked with fixing a bug. Analyze the error and propose a fix.
-
-SENTRY ERROR INFORMATION:
+    prompt = f"""SENTRY ERROR INFORMATION:
 - Error Type: {error_type}
 - Error Message: {error_message}
 
@@ -134,40 +315,104 @@ SENTRY ERROR INFORMATION:
 
 FILES ANALYSIS SUMMARY:
 {files_summary if files_summary else 'No additional summary available'}
+"""
+    # A similar past issue's fix is a strong hint, but its verdict says whether it worked
+    prior_fix = state.get("prior_fix") or {}
+    if prior_fix.get("fix"):
+        prior = prior_fix["fix"]
+        prompt += f"""
+SIMILAR PAST ISSUE (similarity {prior_fix['score']:.2f}, sandbox verdict: {prior_fix['verdict']}):
+- Problem: {prior.get('problem', '')}
+- Solution: {prior.get('solution', '')}
+- Files changed: {', '.join(edit['file_path'] for edit in prior.get('edits', []))}
+"""
+    prompt_cache.record_relevant_files(state["repo_url"], [f.get("path") for f in files_list])
 
-TASK:
-1. Analyze the Sentry error to understand what went wrong
-2. Consider the relevant files identified and why they're related to the error
-3. Propose a fix that addresses the root cause
-4. Show the complete fixed code for the affected file(s)
-5. Provide a clear PR title and description
-
-OUTPUT FORMAT:
-Provide your response in the following format:
-
-**File to Fix:** [file path]
-
-**Problem:**
-[Brief description of what's wrong]
-
-**Solution:**
-[Explanation of the fix]
-
-**Fixed Code:**
-```python
-[Complete fixed code for the file]
-```
+    # The instructions and repository context are shared by every investigation on the
+    # repo; when they are registered in the provider's context cache only the issue
+    # details are sent with the request
+    base_llm = get_provider("llm")
+    prefix_cache = get_provider("prompt_cache")
+    prefix = prefix_cache.get(state["repo_url"], FIX_INSTRUCTIONS, [FixProposal])
+    if prefix["name"]:
+        llm = base_llm.bind(cached_content=prefix["name"])
+        base_messages = [("human", prompt)]
+    else:
+        llm = base_llm.bind_tools([FixProposal], tool_choice="FixProposal")
+        base_messages = [("system", prefix["prefix"]), ("human", prompt)]
 
-**PR Title:**
-[Clear, descriptive PR title]
+    def stream_proposal(llm, messages, attempt, cached):
+        # Stream the response so the trace can record time-to-first-token
+        with span("llm.propose_fix", model=base_llm.model, attempt=attempt,
+                  prefix_sha=prefix["sha"], cached=cached) as llm_span:
+            started = time.perf_counter()
+            response = None
+            for chunk in llm.stream(messages):
+                if response is None:
+                    llm_span.set(ttft_s=time.perf_counter() - started)
+                    response = chunk
+                else:
+                    response = response + chunk
+            usage = getattr(response, "usage_metadata", None) or {}
+            llm_span.set(
+                prompt_tokens=usage.get("input_tokens"),
+                output_tokens=usage.get("output_tokens"),
+                cached_tokens=(usage.get("input_token_details") or {}).get("cache_read"),
+            )
+        return response
 
-**PR Description:**
-[Detailed description of the fix and why it solves the issue]
-"""
+    messages = base_messages
+    cached = bool(prefix["name"])
+    error = None
+    for attempt in range(1 + MAX_FIX_REPAIRS):
+        try:
+            response = stream_proposal(llm, messages, attempt, cached)
+        except Exception as e:
+            # The cache can expire or disappear between get() and a later repair attempt;
+            # send the prefix inline from then on instead of failing the investigation
+            if not cached or not prompt_cache.is_missing_cache_error(e):
+                raise
+            print(f"Prompt cache {prefix['name']} is gone, sending the prefix inline: {e}")
+            prefix_cache.discard(prefix)
+            cached = False
+            llm = base_llm.bind_tools([FixProposal], tool_choice="FixProposal")
+            base_messages = [("system", prefix["prefix"])] + base_messages
+            messages = [("system", prefix["prefix"])] + messages
+            response = stream_proposal(llm, messages, attempt, cached)
+        tool_calls = getattr(response, "tool_calls", None) or []
+        try:
+            if not tool_calls:
+                raise ValueError("no FixProposal tool call in the response")
+            proposal = validate_fix_proposal(tool_calls[0]["args"])
+            break
+        except ValueError as e:
+            # Only schema failures are retried, with the error fed back to the model
+            error = str(e)
+            print(f"FixProposal failed validation (attempt {attempt + 1}): {error}")
+            messages = base_messages + [
+                ("ai", json.dumps(tool_calls[0]["args"]) if tool_calls else (response.content if response else "")),
+                ("human", f"That output did not match the FixProposal schema: {error}. Call FixProposal again with a corrected object."),
+            ]
+    else:
+        return {
+            "fix_edits": [],
+            "needs_approval": True,
+            "messages": [f"❌ Could not get a valid fix proposal: {error}"]
+        }
     
-    response = llm.invoke(prompt)
-    return {"proposed_fix": response.content, "needs_approval": True}
+    return {
+        "fix_problem": proposal["problem"],
+        "fix_solution": proposal["solution"],
+        "fix_edits": [
+            {"file_path": edit["file_path"], "content_ref": blobstore.put_text(edit["content"])}
+            for edit in proposal["edits"]
+        ],
+        "pr_title": proposal["pr_title"],
+        "pr_description": proposal["pr_description"],
+        "needs_approval": True
+    }
 
+@traced("node.approval")
 def human_approval_node(state):
     """Wait for human approval - in Streamlit this is handled by UI buttons"""
     # The actual approval is handled in the UI
@@ -175,67 +420,18 @@ def human_approval_node(state):
     # When user clicks approve, we'll update needs_approval to False
     return state
 
-def extract_pr_info(proposed_fix: str) -> dict:
-    """Extract PR title, description, file path, and code from proposed fix"""
-    lines = proposed_fix.split("\n")
-    
-    pr_title = None
-    pr_description = None
-    file_to_fix = None
-    fixed_code = None
-    
-    in_code_block = False
-    code_lines = []
-    description_lines = []
-    
-    for i, line in enumerate(lines):
-        # Extract PR title
-        if "**PR Title:**" in line:
-            pr_title = line.split("**PR Title:**")[-1].strip()
-        
-        # Extract file path - clean it up (remove backticks, quotes, etc.)
-        if "**File to Fix:**" in line:
-            file_to_fix = line.split("**File to Fix:**")[-1].strip()
-            # Remove backticks, quotes, and extra whitespace
-            import re
-            file_to_fix = re.sub(r'[`"\']', '', file_to_fix).strip()
-        
-        # Extract PR description
-        if "**PR Description:**" in line:
-            # Description starts on next line
-            for j in range(i + 1, len(lines)):
-                if lines[j].startswith("**") and ":" in lines[j]:
-                    break
-                description_lines.append(lines[j])
-            pr_description = "\n".join(description_lines).strip()
-        
-        # Extract code block
-        if "```" in line:
-            if not in_code_block:
-                in_code_block = True
-                code_lines = []
-            else:
-                in_code_block = False
-                if code_lines:
-                    fixed_code = "\n".join(code_lines)
-        elif in_code_block:
-            code_lines.append(line)
-    
-    return {
-        "title": pr_title or "Fix: Bug resolution",
-        "description": pr_description or proposed_fix,
-        "file_path": file_to_fix,
-        "code": fixed_code
-    }
-
+@traced("node.create_pr")
 def create_pr_node(state):
     """Create a GitHub PR with the fix and trigger CodeRabbit review"""
     repo_url = state.get("repo_url", "")
-    proposed_fix = state.get("proposed_fix", "")
-    
-    # Extract PR information from proposed fix
-    pr_info = extract_pr_info(proposed_fix)
-    print(pr_info)
+    fix_edits = state.get("fix_edits") or []
+    # No validated fix means nothing to propose - don't open an empty placeholder PR
+    if not fix_edits:
+        return {
+            "final_pr_url": "",
+            "messages": ["❌ No valid fix proposal; PR not created"]
+        }
+    first_edit = fix_edits[0]
     
     # Generate branch name from error ID or use default
     error_id = state.get("error_id", "bugfix")
@@ -243,17 +439,19 @@ def create_pr_node(state):
     print(branch_name)
     # Create the PR
     try:
-        print(f"PR Info extracted - Title: {pr_info['title']}, File: {pr_info['file_path']}, Has code: {bool(pr_info['code'])}")
+        print(f"PR Info - Title: {state.get('pr_title')}, Files: {[e['file_path'] for e in fix_edits]}")
         
         pr_url, pr_number = create_draft_pr(
             repo=repo_url,
             branch=branch_name,
-            title=pr_info["title"],
-            body=pr_info["description"],
-            file_path=pr_info["file_path"],
-            file_content=pr_info["code"]
+            title=state.get("pr_title") or "Fix: Bug resolution",
+            body=state.get("pr_description") or state.get("fix_solution", ""),
+            file_path=first_edit.get("file_path"),
+            file_content=blobstore.get_text(first_edit.get("content_ref", ""))
         )
         
+        _remember(state, pr_url=pr_url)
+        
         return {
             "final_pr_url": pr_url,
             "pr_number": pr_number,
@@ -272,18 +470,37 @@ def create_pr_node(state):
             "messages": [error_msg]
         }
 
-graph = StateGraph(AgentState)
-graph.add_node("sentry_analysis", sentry_analysis_node)
-graph.add_node("daytona", daytona_node)
-graph.add_node("propose_fix", propose_fix_node)
-graph.add_node("approval", human_approval_node)
-graph.add_node("create_pr", create_pr_node)
+@lru_cache(maxsize=None)
+def get_app():
+    """Build and compile the graph once per process"""
+    from langgraph.graph import StateGraph, END
+    from langgraph.checkpoint.memory import MemorySaver
+
+    graph = StateGraph(AgentState)
+    graph.add_node("recall", recall_node)
+    graph.add_node("sentry_analysis", sentry_analysis_node)
+    graph.add_node("daytona", daytona_node)
+    graph.add_node("propose_fix", propose_fix_node)
+    graph.add_node("approval", human_approval_node)
+    graph.add_node("create_pr", create_pr_node)
+
+    # A reused fix goes straight to the sandbox; anything else starts the full analysis
+    graph.add_conditional_edges(
+        "recall",
+        lambda state: "daytona" if (state.get("prior_fix") or {}).get("reused") else "sentry_analysis",
+        {"daytona": "daytona", "sentry_analysis": "sentry_analysis"},
+    )
+    graph.add_edge("sentry_analysis", "propose_fix")
+    graph.add_edge("propose_fix", "daytona")
+    graph.add_edge("daytona", "approval")  # Go to approval after testing
+    graph.add_edge("approval",'create_pr')
+    graph.add_edge("create_pr", END)
 
-graph.add_edge("sentry_analysis", "propose_fix")
-graph.add_edge("propose_fix", "daytona")
-graph.add_edge("daytona", "approval")  # Go to approval after testing
-graph.add_edge("approval",'create_pr')
-graph.add_edge("create_pr", END)
+    graph.set_entry_point("recall")
+    return graph.compile(checkpointer=MemorySaver())
 
-graph.set_entry_point("sentry_analysis")
-app = graph.compile(checkpointer=MemorySaver())
\ No newline at end of file
+def __getattr__(name):
+    # Keep `from agent import app` working without compiling the graph at import time
+    if name == "app":
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,369 @@
+# bench/fakes.py
+"""Local stand-ins for every backend the graph talks to: Sentry, GitHub, Daytona, Gemini and browser_use"""
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import Counter
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from browser_pool import BrowserPool
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# Request counts per backend, shared by every fake
+request_counts = Counter()
+_counts_lock = threading.Lock()
+
+
+def count(backend: str, n: int = 1):
+    with _counts_lock:
+        request_counts[backend] += n
+
+
+def reset_counts():
+    with _counts_lock:
+        request_counts.clear()
+
+
+def load_fixture(name: str):
+    with open(os.path.join(FIXTURES_DIR, name)) as f:
+        return json.load(f)
+
+
+class _FakeServer:
+    """Run a ThreadingHTTPServer on a free local port in a daemon thread"""
+
+    def __init__(self, handler_class):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    backend = ""
+    latency = 0.0
+
+    def _send(self, status: int, payload):
+        # str payloads are sent as-is, like GitHub's raw/sha media types
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain"
+        else:
+            body, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _dispatch(self, method: str):
+        count(self.backend)
+        if self.latency:
+            time.sleep(self.latency)
+        path, _, query = self.path.partition("?")
+        self.query = {k: v[-1] for k, v in parse_qs(query).items()}
+        status, payload = self.route(method, path)
+        self._send(status, payload)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def route(self, method: str, path: str):
+        return 404, {"detail": "Not found"}
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_sentry(latency: float = 0.0) -> _FakeServer:
+    """Serve recorded issues/events from bench/fixtures on the Sentry REST paths tools.py uses"""
+    issues = load_fixture("sentry_issues.json")
+    events = load_fixture("sentry_events.json")
+
+    class SentryHandler(_JSONHandler):
+        backend = "sentry"
+
+        def route(self, method, path):
+            if re.fullmatch(r"/api/0/(projects/[^/]+/[^/]+|organizations/[^/]+)/issues/", path):
+                return 200, issues
+            match = re.fullmatch(r"/api/0/issues/([^/]+)/events/", path)
+            if match and match.group(1) in events:
+                return 200, events[match.group(1)]
+            return 404, {"detail": "The requested resource does not exist"}
+
+    SentryHandler.latency = latency
+    return _FakeServer(SentryHandler).start()
+
+
+def start_fake_github(latency: float = 0.0) -> _FakeServer:
+    """Minimal GitHub REST API covering the calls made by create_draft_pr and the prompt-prefix cache"""
+    state = {"refs": {}, "pulls": [], "lock": threading.Lock()}
+    base_sha = "0" * 40
+
+    class GitHubHandler(_JSONHandler):
+        backend = "github"
+
+        def route(self, method, path):
+            match = re.fullmatch(r"/repos/([^/]+/[^/]+)(/.*)?", path)
+            if not match:
+                return 404, {"message": "Not Found"}
+            repo, rest = match.group(1), match.group(2) or ""
+            with state["lock"]:
+                refs = state["refs"].setdefault(repo, {"main": base_sha})
+                if method == "GET" and rest == "":
+                    return 200, {"full_name": repo, "default_branch": "main"}
+                ref = re.fullmatch(r"/git/refs?/heads/(.+)", rest)
+                if ref and method == "GET":
+                    if ref.group(1) not in refs:
+                        return 404, {"message": "Not Found"}
+                    return 200, {"object": {"sha": refs[ref.group(1)]}}
+                if ref and method == "PATCH":
+                    refs[ref.group(1)] = self._read_json()["sha"]
+                    return 200, {"object": {"sha": refs[ref.group(1)]}}
+                if rest == "/git/refs" and method == "POST":
+                    data = self._read_json()
+                    branch = data["ref"].replace("refs/heads/", "")
+                    if branch in refs:
+                        return 422, {"message": "Reference already exists"}
+                    refs[branch] = data["sha"]
+                    return 201, {"ref": data["ref"], "object": {"sha": data["sha"]}}
+                if rest == "/commits/HEAD" and method == "GET":
+                    return 200, refs["main"]
+                contents = re.fullmatch(r"/contents/(.+)", rest)
+                if contents and method == "GET":
+                    return 200, f"# {contents.group(1)} at {refs['main'][:8]}\n"
+                commit = re.fullmatch(r"/git/commits/([0-9a-f]+)", rest)
+                if commit and method == "GET":
+                    return 200, {"sha": commit.group(1), "tree": {"sha": "1" * 40}}
+                if rest == "/git/commits" and method == "POST":
+                    data = self._read_json()
+                    sha = hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+                    return 201, {"sha": sha}
+                if rest == "/pulls" and method == "GET":
+                    # Like GitHub: `head` is "owner:branch", `state` defaults to open
+                    head, pr_state = self.query.get("head"), self.query.get("state", "open")
+                    return 200, [
+                        p for p in state["pulls"]
+                        if p["repo"] == repo
+                        and (head is None or p["head"]["label"] == head)
+                        and pr_state in ("all", p["state"])
+                    ]
+                if rest == "/pulls" and method == "POST":
+                    data = self._read_json()
+                    number = len(state["pulls"]) + 1
+                    pull = {
+                        "repo": repo,
+                        "number": number,
+                        "html_url": f"https://github.com/{repo}/pull/{number}",
+                        "state": "open",
+                        "head": {"ref": data["head"], "label": f"{repo.split('/')[0]}:{data['head']}"},
+                    }
+                    state["pulls"].append(pull)
+                    return 201, pull
+            return 404, {"message": "Not Found"}
+
+    GitHubHandler.latency = latency
+    return _FakeServer(GitHubHandler).start()
+
+
+class _ExecResponse:
+    def __init__(self, exit_code: int, result: str):
+        self.exit_code = exit_code
+        self.result = result
+
+
+class FakeSandbox:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.id = f"fake-sandbox-{time.time_ns()}"
+        self.files = {}
+        self.git = self
+        self.fs = self
+        self.process = self
+
+    def _op(self, name: str):
+        count(f"sandbox.{name}")
+        if self.latency:
+            time.sleep(self.latency)
+
+    def wait_for_sandbox_start(self, timeout=60):
+        self._op("start")
+
+    def get_user_home_dir(self):
+        return "/home/daytona"
+
+    def clone(self, url, path=".", branch="main"):
+        self._op("clone")
+
+    def upload_file(self, data: bytes, remote_path: str):
+        self._op("upload")
+        self.files[remote_path] = data
+
+    def exec(self, command: str, cwd: str = None, timeout: int = None):
+        self._op("exec")
+        return _ExecResponse(0, f"$ {command}\nok")
+
+    def delete(self):
+        self._op("delete")
+
+
+class FakeDaytona:
+    """Drop-in for the "daytona" provider; every sandbox operation sleeps `latency` seconds"""
+    latency = 0.0
+
+    def __init__(self, config=None):
+        self.config = config
+
+    def create(self):
+        count("sandbox.create")
+        if self.latency:
+            time.sleep(self.latency)
+        return FakeSandbox(self.latency)
+
+
+FAKE_FIX_PROPOSAL = {
+    "problem": "`compute_average` divides by `len(values)` without checking for an empty list.",
+    "solution": "Return 0 for an empty input instead of dividing by zero.",
+    "edits": [{
+        "file_path": "app.py",
+        "content": "def compute_average(values):\n    if not values:\n        return 0\n    return sum(values) / len(values)\n",
+    }],
+    "pr_title": "Fix ZeroDivisionError in compute_average for empty input",
+    "pr_description": "Guard against empty lists in `compute_average` so the stats endpoint no longer crashes.",
+}
+
+
+class FakeMessageChunk:
+    def __init__(self, content: str = "", usage_metadata: dict = None, tool_calls: list = None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+        self.tool_calls = tool_calls or []
+
+    def __add__(self, other):
+        usage = other.usage_metadata or self.usage_metadata
+        return FakeMessageChunk(self.content + other.content, usage, self.tool_calls + other.tool_calls)
+
+
+class FakeLLM:
+    """Deterministic stand-in for the "llm" provider (ChatGoogleGenerativeAI).
+
+    bind_tools()/bind() return the same model; every call answers with one tool call whose
+    args are `proposal`, streamed after `latency` seconds.
+    """
+    model = "fake-gemini"
+
+    def __init__(self, latency: float = 0.0, proposal: dict = None):
+        self.latency = latency
+        self.proposal = proposal or FAKE_FIX_PROPOSAL
+        self.tool_name = None
+        self.cached_content = None
+
+    def bind(self, cached_content=None, **kwargs):
+        # A cached prefix carries the FixProposal tool, as GeminiContextCache registers it
+        self.cached_content = cached_content
+        self.tool_name = self.tool_name or "FixProposal"
+        return self
+
+    def bind_tools(self, tools, tool_choice=None, **kwargs):
+        self.tool_name = tool_choice or getattr(tools[0], "__name__", "tool")
+        return self
+
+    def invoke(self, messages):
+        chunk = None
+        for part in self.stream(messages):
+            chunk = part if chunk is None else chunk + part
+        return chunk
+
+    def stream(self, messages):
+        count("llm")
+        if self.latency:
+            time.sleep(self.latency)
+        args = json.dumps(self.proposal)
+        yield FakeMessageChunk()
+        yield FakeMessageChunk(tool_calls=[{"name": self.tool_name, "args": self.proposal, "id": "call-0"}])
+        yield FakeMessageChunk(usage_metadata={
+            "input_tokens": len(str(messages)) // 4,
+            "output_tokens": len(args) // 4,
+        })
+
+
+class _FakeAgentState:
+    def __init__(self):
+        self.n_steps = 1
+
+
+class _FakeAgent:
+    def __init__(self):
+        self.state = _FakeAgentState()
+
+
+async def drive_browser_steps(on_step_start, on_step_end, steps: int = 2, latency: float = 0.0):
+    """Call step hooks in browser_use's order: on_step_start, step() (which bumps n_steps), on_step_end"""
+    agent = _FakeAgent()
+    for _ in range(steps):
+        await on_step_start(agent)
+        if latency:
+            await asyncio.sleep(latency / steps)
+        agent.state.n_steps += 1
+        await on_step_end(agent)
+
+
+def make_fake_browser_task(latency: float = 0.0):
+    """Async replacement for tools._run_browser_task returning canned JSON for each task type"""
+    import tools
+    step_hooks = tools._browser_step_hooks
+
+    async def fake_run_browser_task(task: str, browser_session=None) -> str:
+        count("browser")
+        await drive_browser_steps(*step_hooks(), latency=latency)
+        if "/issues" in task:
+            return "[]"
+        return json.dumps({
+            "files": [{"path": "app.py", "reason": "Stack trace points at compute_average", "line_number": 42}],
+            "summary": "The division happens in app.py",
+        })
+    return fake_run_browser_task
+
+
+class FakeBrowserPool(BrowserPool):
+    """BrowserPool whose sessions are placeholders; launching one takes `launch_latency` seconds"""
+
+    def __init__(self, launch_latency: float = 0.0, **kwargs):
+        self.launch_latency = launch_latency
+        super().__init__(**kwargs)
+
+    async def _launch(self, slot):
+        count("browser_launch")
+        if self.launch_latency:
+            await asyncio.sleep(self.launch_latency)
+        return object()
+
+    async def _close(self, session):
+        pass
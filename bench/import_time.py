@@ -0,0 +1,62 @@
+# bench/import_time.py
+"""Import-time budget for the modules Streamlit re-imports on every cold start.
+
+Imports `agent` and `tools` in a fresh interpreter, fails if that takes longer than the
+budget or if any heavy backend was imported eagerly (they must load through providers.py):
+
+    python -m bench.import_time --budget 0.5
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Backends that must not be imported until first use
+HEAVY_MODULES = ("browser_use", "daytona", "langchain_google_genai", "sentry_sdk", "langgraph")
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import agent, tools
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+def measure(runs: int = 3) -> dict:
+    """Best-of-N import time of agent+tools plus any heavy modules that were pulled in"""
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timings = []
+    eager = set()
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", _PROBE],
+            cwd=repo_root, capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        timings.append(result["seconds"])
+        eager.update(m for m in result["modules"] if m.split(".")[0] in HEAVY_MODULES)
+    return {"seconds": min(timings), "eager_heavy_modules": sorted({m.split(".")[0] for m in eager})}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Check the agent/tools import-time budget")
+    parser.add_argument("--budget", type=float, default=0.5, help="max seconds to import agent+tools")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    result = measure(args.runs)
+    print(json.dumps({**result, "budget": args.budget}, indent=2))
+    failures = []
+    if result["seconds"] > args.budget:
+        failures.append(f"import took {result['seconds']:.3f}s (budget {args.budget:.3f}s)")
+    if result["eager_heavy_modules"]:
+        failures.append(f"heavy backends imported eagerly: {', '.join(result['eager_heavy_modules'])}")
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+# bench/run.py
+"""Offline end-to-end benchmark of the compiled `app` graph.
+
+Every backend is replaced by a local fake (see bench/fakes.py), so this runs with no
+network access:
+
+    python -m bench.run --investigations 20 --concurrency 4
+    python -m bench.run --baseline bench/baseline.json
+
+With --baseline the run exits non-zero when p95 latency regresses by more than
+--tolerance or when any backend receives more requests per investigation than before.
+bench/baseline.json is a report from the default settings; refresh it with
+--output bench/baseline.json when a change is meant to move the numbers.
+
+The browser pool is warmed and one untimed investigation runs first, so browser
+launches and the graph compile are not counted against the timed passes.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from bench import fakes
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, round(q * (len(values) - 1)))]
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def setup(args):
+    """Start the fake servers, point the tools at them and patch in the fake LLM/browser/sandbox"""
+    sentry = fakes.start_fake_sentry(latency=args.http_latency)
+    github = fakes.start_fake_github(latency=args.http_latency)
+    os.environ.update({
+        "SENTRY_API_URL": f"{sentry.url}/api/0",
+        "SENTRY_ORG_SLUG": "bench-org",
+        "SENTRY_PROJECT_SLUG": "demo-app",
+        "SENTRY_TOKEN": "bench",
+        "GITHUB_API_URL": github.url,
+        "GITHUB_TOKEN": "bench",
+        "GOOGLE_API_KEY": os.getenv("GOOGLE_API_KEY", "bench"),
+        "BUGHUNTER_BLOB_DIR": tempfile.mkdtemp(prefix="bughunter-bench-blobs-"),
+        "BUGHUNTER_HOT_FILES_DB": os.path.join(tempfile.mkdtemp(prefix="bughunter-bench-hot-"), "hot_files.db"),
+        "BUGHUNTER_PROMPT_CACHE": "local",
+        "BUGHUNTER_KNOWLEDGE_DB": os.path.join(tempfile.mkdtemp(prefix="bughunter-bench-knowledge-"), "knowledge.db"),
+    })
+
+    if not args.warm:
+        # Never reuse a past fix, so every investigation runs the full pipeline
+        os.environ["BUGHUNTER_RECALL_REUSE_SCORE"] = "inf"
+
+    from providers import register_provider
+    import agent
+    import tools
+
+    fakes.FakeDaytona.latency = args.sandbox_latency
+    register_provider("daytona", fakes.FakeDaytona)
+    register_provider("llm", lambda: fakes.FakeLLM(latency=args.llm_latency))
+    register_provider("browser_pool", lambda: fakes.FakeBrowserPool(
+        launch_latency=args.browser_launch_latency, size=args.concurrency,
+    ))
+    tools._run_browser_task = fakes.make_fake_browser_task(latency=args.browser_latency)
+    return agent, tools, [sentry, github]
+
+
+def check_browser_step_hooks(tools):
+    """Run tools' browser_use step hooks the way browser_use does and make sure every step is timed"""
+    import asyncio
+    import tracing
+
+    was_enabled = tracing.is_enabled()
+    tracing.enable()
+    try:
+        before = tracing._stage_totals["browser.step"][0]
+        asyncio.run(fakes.drive_browser_steps(*tools._browser_step_hooks(), steps=3))
+        recorded = tracing._stage_totals["browser.step"][0] - before
+    finally:
+        tracing.enable(was_enabled)
+    if recorded != 3:
+        raise RuntimeError(f"browser_use step hooks recorded {recorded} browser.step spans for 3 steps")
+
+
+def run_investigation(agent, tools, error_id: str, thread_id: str) -> float:
+    """One investigation the way main.py drives it; returns wall-clock seconds"""
+    started = time.perf_counter()
+    sentry_error_data = tools.get_sentry_error(error_id)
+    initial = agent.build_initial_state(error_id, "https://github.com/bench/demo-app", sentry_error_data)
+    final = agent.get_app().invoke(initial, {"configurable": {"thread_id": thread_id}})
+    if not final.get("final_pr_url"):
+        raise RuntimeError(f"Investigation {thread_id} did not produce a PR: {final.get('messages')}")
+    return time.perf_counter() - started
+
+
+def run_benchmark(args) -> dict:
+    agent, tools, servers = setup(args)
+    from providers import get_provider
+    try:
+        check_browser_step_hooks(tools)
+        issues = tools.get_sentry_issues()
+        issue_ids = [issue["id"] for issue in issues]
+        # Warm-up: launch the pooled browsers and compile the graph outside the timed passes
+        wait(get_provider("browser_pool").warm())
+        run_investigation(agent, tools, issue_ids[0], "bench-warmup")
+        fakes.reset_counts()
+
+        # Sequential pass: latency per investigation without contention
+        latencies = []
+        for i in range(args.investigations):
+            latencies.append(run_investigation(agent, tools, issue_ids[i % len(issue_ids)], f"bench-seq-{i}"))
+        per_investigation = {
+            backend: n / args.investigations for backend, n in sorted(fakes.request_counts.items())
+        }
+        checkpoint = agent.checkpoint_size({"configurable": {"thread_id": "bench-seq-0"}})
+        event = tools.get_sentry_error(issue_ids[0])
+        event_bytes = {
+            "full": len(json.dumps(event)),
+            "in_state": len(json.dumps(tools.prune_sentry_event(event))),
+        }
+
+        # Concurrent pass: throughput with `concurrency` investigations in flight
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            concurrent_latencies = list(pool.map(
+                lambda i: run_investigation(agent, tools, issue_ids[i % len(issue_ids)], f"bench-par-{i}"),
+                range(args.investigations),
+            ))
+        elapsed = time.perf_counter() - started
+    finally:
+        for server in servers:
+            server.stop()
+
+    return {
+        "investigations": args.investigations,
+        "concurrency": args.concurrency,
+        "latency_s": {
+            "p50": _percentile(latencies, 0.50),
+            "p95": _percentile(latencies, 0.95),
+            "max": max(latencies),
+        },
+        "concurrent_latency_s": {
+            "p50": _percentile(concurrent_latencies, 0.50),
+            "p95": _percentile(concurrent_latencies, 0.95),
+        },
+        "throughput_per_s": args.investigations / elapsed,
+        "requests_per_investigation": per_investigation,
+        "checkpoints_per_investigation": checkpoint["checkpoints"],
+        "checkpoint_bytes_per_investigation": checkpoint["bytes"],
+        "sentry_event_bytes": event_bytes,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def compare_to_baseline(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Return a list of regressions relative to a previous report"""
+    regressions = []
+    limit = baseline["latency_s"]["p95"] * (1 + tolerance)
+    if report["latency_s"]["p95"] > limit:
+        regressions.append(f"p95 latency {report['latency_s']['p95']:.3f}s exceeds {limit:.3f}s")
+    for backend, n in report["requests_per_investigation"].items():
+        before = baseline.get("requests_per_investigation", {}).get(backend, 0)
+        if n > before:
+            regressions.append(f"{backend}: {n:g} requests per investigation (baseline {before:g})")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Offline BugHunter benchmark")
+    parser.add_argument("--investigations", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--sandbox-latency", type=float, default=0.01, help="seconds per sandbox operation")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds before the first LLM token")
+    parser.add_argument("--browser-latency", type=float, default=0.05, help="seconds per browser task")
+    parser.add_argument("--browser-launch-latency", type=float, default=0.5, help="seconds to launch a pooled browser")
+    parser.add_argument("--http-latency", type=float, default=0.0, help="seconds per Sentry/GitHub request")
+    parser.add_argument("--warm", action="store_true",
+                        help="let repeated issues reuse fixes from the knowledge store (default: every run is cold)")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--baseline", help="previous JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative p95 regression")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# blobstore.py
+import os
+import re
+import json
+import time
+import zlib
+import hashlib
+import tempfile
+from functools import lru_cache
+
+# Content-addressed store for large payloads (Sentry events, proposed fixes, sandbox output).
+# Graph state only carries the returned refs, so checkpoints stay small no matter how
+# many steps a run takes; the payload is read back when a node actually needs it.
+BLOB_DIR = os.getenv("BUGHUNTER_BLOB_DIR", os.path.join(".bughunter", "blobs"))
+# Blobs no store references are deleted once they are this old. The grace period covers
+# refs that only live in in-memory graph state (an inline investigation awaiting approval).
+BLOB_MAX_AGE = float(os.getenv("BUGHUNTER_BLOB_MAX_AGE", str(7 * 24 * 3600)))
+BLOB_SWEEP_INTERVAL = float(os.getenv("BUGHUNTER_BLOB_SWEEP_INTERVAL", "3600"))
+
+_REF = re.compile(r"\b[0-9a-f]{64}\b")
+
+
+def _path(ref: str) -> str:
+    if len(ref) != 64 or not all(c in "0123456789abcdef" for c in ref):
+        raise ValueError(f"Invalid blob ref: {ref!r}")
+    return os.path.join(BLOB_DIR, ref[:2], ref[2:])
+
+
+def put_bytes(data: bytes) -> str:
+    """Store data (zlib-compressed) and return its sha256 ref; identical payloads are stored once"""
+    ref = hashlib.sha256(data).hexdigest()
+    path = _path(ref)
+    if os.path.exists(path):
+        try:
+            # Storing it again counts as a new write for the sweep's age check
+            os.utime(path)
+            return ref
+        except FileNotFoundError:
+            pass  # swept in the meantime; write it again
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp file and rename so concurrent writers never expose a partial blob
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(zlib.compress(data, 6))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return ref
+
+
+def exists(ref: str) -> bool:
+    return bool(ref) and os.path.exists(_path(ref))
+
+
+@lru_cache(maxsize=32)
+def get_bytes(ref: str) -> bytes:
+    """Load a blob by ref (raises FileNotFoundError if it was never stored)"""
+    with open(_path(ref), "rb") as f:
+        return zlib.decompress(f.read())
+
+
+def put_text(text: str) -> str:
+    return put_bytes((text or "").encode("utf-8"))
+
+
+def get_text(ref: str) -> str:
+    """Load a text blob; an empty ref yields an empty string"""
+    return get_bytes(ref).decode("utf-8") if ref else ""
+
+
+def put_json(obj) -> str:
+    return put_bytes(json.dumps(obj, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+
+
+def get_json(ref: str):
+    return json.loads(get_bytes(ref)) if ref else None
+
+
+def refs_in(text: str) -> set:
+    """Blob refs mentioned anywhere in a string (e.g. a JSON column holding graph state)"""
+    return set(_REF.findall(text or ""))
+
+
+def sweep(referenced: set, max_age: float = BLOB_MAX_AGE) -> tuple:
+    """Delete blobs outside `referenced` last written more than `max_age` seconds ago.
+
+    Returns (blobs removed, bytes freed).
+    """
+    cutoff = time.time() - max_age
+    removed = freed = 0
+    if not os.path.isdir(BLOB_DIR):
+        return removed, freed
+    for prefix in os.listdir(BLOB_DIR):
+        directory = os.path.join(BLOB_DIR, prefix)
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            # Leftover temp files from interrupted writes have no valid ref and are swept too
+            if prefix + name in referenced:
+                continue
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+                if stat.st_mtime >= cutoff:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+            freed += stat.st_size
+    return removed, freed
+
+
+def collect_garbage(max_age: float = BLOB_MAX_AGE) -> tuple:
+    """Sweep blobs that neither the issue store, the job queue nor the knowledge store references"""
+    import issue_store
+    import job_queue
+    import knowledge_store
+
+    referenced = issue_store.blob_refs() | job_queue.blob_refs() | knowledge_store.blob_refs()
+    removed, freed = sweep(referenced, max_age)
+    if removed:
+        print(f"Removed {removed} unreferenced blobs ({freed / 1e6:.1f} MB)")
+    return removed, freed
@@ -0,0 +1,194 @@
+# browser_pool.py
+import os
+import fcntl
+import atexit
+import asyncio
+import threading
+import contextvars
+import concurrent.futures
+
+from tracing import span
+
+# Long-lived headless browsers for browser_use tasks. All sessions live on one
+# background event loop, so callers on any thread (Streamlit reruns, LangGraph nodes,
+# worker processes) reuse them instead of launching Chromium under a throwaway
+# asyncio.run(). Each slot keeps its own profile directory, so cookies and GitHub
+# session state survive recycling. Chromium cannot share a profile directory, so
+# slots claim `slot-<n>` directories with a file lock and every process (Streamlit,
+# each worker) ends up with directories of its own.
+BROWSER_POOL_SIZE = int(os.getenv("BUGHUNTER_BROWSER_POOL_SIZE", "2"))
+BROWSER_MAX_TASKS = int(os.getenv("BUGHUNTER_BROWSER_MAX_TASKS", "20"))
+BROWSER_PROFILE_DIR = os.getenv("BUGHUNTER_BROWSER_PROFILE_DIR", os.path.join(".bughunter", "browser"))
+
+
+class _Slot:
+    def __init__(self, index: int):
+        self.index = index
+        self.session = None
+        self.tasks = 0
+        self.profile = None
+        self.profile_lock = None
+
+
+class BrowserPool:
+    """Fixed number of browser sessions, each recycled after `max_tasks` tasks or a failed health check.
+
+    run(fn) waits for a free slot and awaits fn(session) on the pool's loop; at most
+    `size` tasks run at once. `warm_urls` are opened whenever a session is launched.
+    """
+
+    def __init__(self, size: int = BROWSER_POOL_SIZE, max_tasks: int = BROWSER_MAX_TASKS,
+                 warm_urls: list[str] = None, profile_dir: str = BROWSER_PROFILE_DIR):
+        self.size = size
+        self.max_tasks = max_tasks
+        self.warm_urls = list(warm_urls or [])
+        self.profile_dir = profile_dir
+        self.launched = 0
+        self._closed = False
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name="browser-pool")
+        self._thread.start()
+        self._slots = [_Slot(i) for i in range(size)]
+        self._free = asyncio.run_coroutine_threadsafe(self._make_queue(), self._loop).result()
+        atexit.register(self.close)
+
+    async def _make_queue(self) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        for slot in self._slots:
+            queue.put_nowait(slot)
+        return queue
+
+    def _claim_profile(self, slot: _Slot) -> str:
+        """First `slot-<n>` profile directory no other slot or process holds; kept until close()"""
+        if slot.profile is None:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            n = 0
+            while True:
+                path = os.path.abspath(os.path.join(self.profile_dir, f"slot-{n}"))
+                lock = open(path + ".lock", "a")
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    lock.close()
+                    n += 1
+                    continue
+                slot.profile, slot.profile_lock = path, lock
+                break
+        return slot.profile
+
+    def _release_profile(self, slot: _Slot):
+        if slot.profile_lock is not None:
+            slot.profile_lock.close()
+        slot.profile, slot.profile_lock = None, None
+
+    # Session lifecycle; the fake pool in bench/fakes.py overrides _launch and _close
+    async def _launch(self, slot: _Slot):
+        from browser_use import BrowserSession, BrowserProfile
+        session = BrowserSession(browser_profile=BrowserProfile(
+            headless=True,
+            keep_alive=True,
+            user_data_dir=self._claim_profile(slot),
+        ))
+        await session.start()
+        for url in self.warm_urls:
+            try:
+                await session.navigate_to(url)
+            except Exception as e:
+                print(f"Pre-warming {url} failed: {e}")
+        return session
+
+    async def _close(self, session):
+        await session.kill()
+
+    async def _healthy(self, session) -> bool:
+        # browser_use exposes the CDP connection state as `is_cdp_connected`; sessions
+        # without it are assumed healthy rather than relaunched before every task
+        connected = getattr(session, "is_cdp_connected", None)
+        if connected is None:
+            return True
+        if callable(connected):
+            connected = connected()
+        if asyncio.iscoroutine(connected):
+            connected = await connected
+        return bool(connected)
+
+    async def _recycle(self, slot: _Slot):
+        if slot.session is not None:
+            try:
+                await self._close(slot.session)
+            except Exception as e:
+                print(f"Closing browser slot {slot.index} failed: {e}")
+        slot.session, slot.tasks = None, 0
+
+    async def _ready(self, slot: _Slot):
+        """Make sure a slot holds a healthy session that has not reached max_tasks"""
+        if slot.session is not None and (slot.tasks >= self.max_tasks or not await self._healthy(slot.session)):
+            await self._recycle(slot)
+        if slot.session is None:
+            with span("browser.launch", slot=slot.index, warm_urls=len(self.warm_urls)):
+                slot.session = await self._launch(slot)
+            self.launched += 1
+
+    async def _run(self, fn):
+        with span("browser.acquire", pool_size=self.size):
+            slot = await self._free.get()
+        try:
+            await self._ready(slot)
+            slot.tasks += 1
+            try:
+                return await fn(slot.session)
+            except Exception:
+                # A failed task may leave the browser on an error page or disconnected
+                await self._recycle(slot)
+                raise
+        finally:
+            self._free.put_nowait(slot)
+
+    def run(self, fn, timeout: float = None):
+        """Run coroutine function `fn(session)` on a pooled browser and return its result (blocking)"""
+        # Start the task in the caller's context so its spans join the current trace
+        context = contextvars.copy_context()
+        result = concurrent.futures.Future()
+
+        def start():
+            task = self._loop.create_task(self._run(fn), context=context)
+            task.add_done_callback(lambda t: result.cancel() if t.cancelled() else (
+                result.set_exception(t.exception()) if t.exception() else result.set_result(t.result())
+            ))
+
+        self._loop.call_soon_threadsafe(start)
+        return result.result(timeout)
+
+    def warm(self) -> list:
+        """Launch every slot in the background so the first investigations skip the browser start.
+
+        Returns one future per slot for callers that want to wait for the launches.
+        """
+        async def warm_slot():
+            slot = await self._free.get()
+            try:
+                await self._ready(slot)
+            except Exception as e:
+                print(f"Warming browser slot {slot.index} failed: {e}")
+            finally:
+                self._free.put_nowait(slot)
+
+        return [asyncio.run_coroutine_threadsafe(warm_slot(), self._loop) for _ in self._slots]
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+
+        async def close_all():
+            for slot in self._slots:
+                await self._recycle(slot)
+                self._release_profile(slot)
+
+        try:
+            asyncio.run_coroutine_threadsafe(close_all(), self._loop).result(30)
+        except Exception as e:
+            print(f"Closing the browser pool failed: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
@@ -0,0 +1,246 @@
+# issue_store.py
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import blobstore
+from tools import iter_sentry_issue_pages, get_sentry_error
+
+# Local copy of the project's unresolved Sentry issues. A background thread keeps it in
+# sync with Sentry and prefetches the latest event of the top issues, so the dashboard
+# only ever queries SQLite (FTS5 for text, indexed columns for the facets).
+ISSUE_DB = os.getenv("BUGHUNTER_ISSUE_DB", os.path.join(".bughunter", "issues.db"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS issues (
+    id TEXT PRIMARY KEY,
+    short_id TEXT,
+    title TEXT,
+    culprit TEXT,
+    level TEXT,
+    count INTEGER,
+    user_count INTEGER,
+    first_seen TEXT,
+    last_seen TEXT,
+    data TEXT NOT NULL,
+    event_ref TEXT,
+    event_last_seen TEXT,
+    refreshed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS issues_last_seen ON issues(last_seen);
+CREATE INDEX IF NOT EXISTS issues_level ON issues(level, last_seen);
+CREATE INDEX IF NOT EXISTS issues_count ON issues(count);
+-- Full-text rows share their issue's rowid (upserts keep it, and the store is never
+-- VACUUMed), so they are replaced and deleted by rowid rather than by scanning the index.
+-- issues_fts was keyed by an UNINDEXED id column; the next refresh repopulates the new table.
+DROP TABLE IF EXISTS issues_fts;
+CREATE VIRTUAL TABLE IF NOT EXISTS issues_search USING fts5(
+    short_id, title, culprit, tokenize = 'unicode61'
+);
+"""
+
+SORT_COLUMNS = {"last_seen": "last_seen DESC", "count": "count DESC", "first_seen": "first_seen DESC"}
+
+
+def connect(path: str = None) -> sqlite3.Connection:
+    path = path or ISSUE_DB
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+@contextmanager
+def _db(path: str = None):
+    conn = connect(path)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def upsert_issues(issues: list[dict], refreshed_at: float, path: str = None):
+    """Insert or update issues from the Sentry API and their full-text entries"""
+    with _db(path) as conn:
+        conn.execute("BEGIN")
+        for issue in issues:
+            issue_id = str(issue.get("id", ""))
+            if not issue_id:
+                continue
+            rowid = conn.execute(
+                """INSERT INTO issues (id, short_id, title, culprit, level, count, user_count, first_seen, last_seen, data, refreshed_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(id) DO UPDATE SET
+                       short_id = excluded.short_id, title = excluded.title, culprit = excluded.culprit,
+                       level = excluded.level, count = excluded.count, user_count = excluded.user_count,
+                       first_seen = excluded.first_seen, last_seen = excluded.last_seen,
+                       data = excluded.data, refreshed_at = excluded.refreshed_at
+                   RETURNING rowid""",
+                (
+                    issue_id, issue.get("shortId", ""), issue.get("title", ""), issue.get("culprit", ""),
+                    issue.get("level", ""), int(issue.get("count") or 0), int(issue.get("userCount") or 0),
+                    issue.get("firstSeen", ""), issue.get("lastSeen", ""), json.dumps(issue), refreshed_at,
+                ),
+            ).fetchone()[0]
+            conn.execute("DELETE FROM issues_search WHERE rowid = ?", (rowid,))
+            conn.execute(
+                "INSERT INTO issues_search (rowid, short_id, title, culprit) VALUES (?, ?, ?, ?)",
+                (rowid, issue.get("shortId", ""), issue.get("title", ""), issue.get("culprit", "")),
+            )
+        conn.execute("COMMIT")
+
+
+def remove_stale(refreshed_before: float, path: str = None) -> int:
+    """Drop issues that were not returned by the latest full refresh (resolved or aged out)"""
+    with _db(path) as conn:
+        conn.execute("BEGIN")
+        conn.execute(
+            "DELETE FROM issues_search WHERE rowid IN (SELECT rowid FROM issues WHERE refreshed_at < ?)",
+            (refreshed_before,),
+        )
+        removed = conn.execute("DELETE FROM issues WHERE refreshed_at < ?", (refreshed_before,)).rowcount
+        conn.execute("COMMIT")
+        return removed
+
+
+def _fts_query(text: str) -> str:
+    # Quote every term and prefix-match it, so user input can never be parsed as FTS syntax
+    terms = re.findall(r"\w+", text or "")
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def search(text: str = "", levels: list = None, culprit: str = "", min_count: int = None, max_count: int = None,
+           seen_after: str = None, seen_before: str = None, sort: str = "last_seen",
+           limit: int = 25, offset: int = 0, path: str = None):
+    """Filter the local issues; returns (page of issue dicts, total matches)"""
+    clauses, params = [], []
+    fts = _fts_query(text)
+    if fts:
+        clauses.append("rowid IN (SELECT rowid FROM issues_search WHERE issues_search MATCH ?)")
+        params.append(fts)
+    if levels:
+        clauses.append(f"level IN ({', '.join('?' for _ in levels)})")
+        params.extend(levels)
+    if culprit:
+        clauses.append("culprit LIKE ?")
+        params.append(f"%{culprit}%")
+    if min_count is not None:
+        clauses.append("count >= ?")
+        params.append(min_count)
+    if max_count is not None:
+        clauses.append("count <= ?")
+        params.append(max_count)
+    if seen_after:
+        clauses.append("last_seen >= ?")
+        params.append(seen_after)
+    if seen_before:
+        clauses.append("last_seen <= ?")
+        params.append(seen_before)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    order = SORT_COLUMNS.get(sort, SORT_COLUMNS["last_seen"])
+
+    with _db(path) as conn:
+        total = conn.execute(f"SELECT COUNT(*) FROM issues {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT data, event_ref FROM issues {where} ORDER BY {order} LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        ).fetchall()
+    issues = []
+    for row in rows:
+        issue = json.loads(row["data"])
+        issue["_event_ref"] = row["event_ref"]
+        issues.append(issue)
+    return issues, total
+
+
+def facet_counts(path: str = None) -> dict:
+    """Issue counts per level, for the facet filter"""
+    with _db(path) as conn:
+        rows = conn.execute("SELECT level, COUNT(*) AS n FROM issues GROUP BY level ORDER BY n DESC").fetchall()
+    return {row["level"]: row["n"] for row in rows}
+
+
+def get_event_ref(issue_id: str, path: str = None):
+    """Blob ref of the prefetched latest event for an issue, if any"""
+    with _db(path) as conn:
+        row = conn.execute("SELECT event_ref FROM issues WHERE id = ?", (str(issue_id),)).fetchone()
+    return row["event_ref"] if row else None
+
+
+def blob_refs(path: str = None) -> set:
+    """Blob refs of the prefetched events, for blobstore.collect_garbage()"""
+    with _db(path) as conn:
+        rows = conn.execute("SELECT event_ref FROM issues WHERE event_ref IS NOT NULL").fetchall()
+    return {row["event_ref"] for row in rows}
+
+
+def prefetch_events(top_n: int, path: str = None) -> int:
+    """Fetch the latest event of the top-N most recently seen issues whose event is missing or outdated"""
+    with _db(path) as conn:
+        rows = conn.execute(
+            """SELECT id, last_seen FROM (SELECT * FROM issues ORDER BY last_seen DESC LIMIT ?)
+               WHERE event_ref IS NULL OR event_last_seen IS NOT last_seen""",
+            (top_n,),
+        ).fetchall()
+    fetched = 0
+    for row in rows:
+        try:
+            event_ref = blobstore.put_json(get_sentry_error(row["id"]))
+        except Exception as e:
+            print(f"Prefetching event for issue {row['id']} failed: {e}")
+            continue
+        with _db(path) as conn:
+            conn.execute(
+                "UPDATE issues SET event_ref = ?, event_last_seen = ? WHERE id = ?",
+                (event_ref, row["last_seen"], row["id"]),
+            )
+        fetched += 1
+    return fetched
+
+
+class IssueRefresher(threading.Thread):
+    """Daemon thread syncing the issue store with Sentry every `interval` seconds"""
+
+    def __init__(self, interval: float = 60, prefetch_top_n: int = 10, max_pages: int = 50, path: str = None):
+        super().__init__(daemon=True, name="sentry-issue-refresher")
+        self.interval = interval
+        self.prefetch_top_n = prefetch_top_n
+        self.max_pages = max_pages
+        self.path = path
+        self.last_refresh = None
+        self.last_sweep = 0
+        self.last_error = None
+        self._wake = threading.Event()
+
+    def refresh_now(self):
+        self._wake.set()
+
+    def refresh(self):
+        started = time.time()
+        for page in iter_sentry_issue_pages(max_pages=self.max_pages):
+            upsert_issues(page, started, path=self.path)
+        remove_stale(started, path=self.path)
+        prefetch_events(self.prefetch_top_n, path=self.path)
+        self.last_refresh = time.time()
+        # Replaced event blobs (and those of finished inline investigations) pile up otherwise
+        if self.last_refresh - self.last_sweep >= blobstore.BLOB_SWEEP_INTERVAL:
+            blobstore.collect_garbage()
+            self.last_sweep = self.last_refresh
+
+    def run(self):
+        while True:
+            try:
+                self.refresh()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Sentry issue refresh failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
@@ -0,0 +1,177 @@
+# job_queue.py
+import os
+import json
+import time
+import sqlite3
+from contextlib import contextmanager
+
+import blobstore
+
+# Persistent investigation queue shared by the webhook receiver, the worker processes
+# and the Streamlit dashboard. SQLite in WAL mode lets several processes read and write
+# the same file; claims use BEGIN IMMEDIATE so two workers never take the same job.
+QUEUE_DB = os.getenv("BUGHUNTER_QUEUE_DB", os.path.join(".bughunter", "queue.db"))
+
+# Jobs in these states block a new job for the same Sentry issue
+ACTIVE_STATUSES = ("queued", "running", "awaiting_approval", "creating_pr")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    issue_id TEXT NOT NULL,
+    repo_url TEXT NOT NULL,
+    payload TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+-- Replaced by jobs_active_issue_v2, which also covers 'creating_pr'
+DROP INDEX IF EXISTS jobs_active_issue;
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_issue_v2
+    ON jobs(issue_id) WHERE status IN ('queued', 'running', 'awaiting_approval', 'creating_pr');
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, id);
+"""
+
+
+def connect(path: str = None) -> sqlite3.Connection:
+    path = path or QUEUE_DB
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+@contextmanager
+def _db(path: str = None):
+    conn = connect(path)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def _row_to_job(row) -> dict:
+    if row is None:
+        return None
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"] or "{}")
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def enqueue(issue_id: str, repo_url: str, payload: dict = None, path: str = None):
+    """Queue an investigation; returns the job id, or None if the issue already has an active job"""
+    now = time.time()
+    with _db(path) as conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO jobs (issue_id, repo_url, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (str(issue_id), repo_url, json.dumps(payload or {}), now, now),
+        )
+        return cursor.lastrowid if cursor.rowcount else None
+
+
+def claim_next(worker: str, path: str = None):
+    """Atomically move the oldest queued job to 'running' and return it (None if the queue is empty)"""
+    conn = connect(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+            (worker, time.time(), row["id"]),
+        )
+        conn.execute("COMMIT")
+        job = _row_to_job(row)
+        job.update(status="running", worker=worker, attempts=job["attempts"] + 1)
+        return job
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def update(job_id: int, status: str, result: dict = None, error: str = None, path: str = None):
+    """Record a job's new status (and optionally its result state or error)"""
+    with _db(path) as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, result = COALESCE(?, result), error = ?, updated_at = ? WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+        )
+
+
+def transition(job_id: int, from_status: str, to_status: str, path: str = None) -> bool:
+    """Move a job from one status to another only if it is still in `from_status`; True if this call did it"""
+    with _db(path) as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (to_status, time.time(), job_id, from_status),
+        )
+        return cursor.rowcount == 1
+
+
+def get_job(job_id: int, path: str = None):
+    with _db(path) as conn:
+        return _row_to_job(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+
+def list_jobs(status: str = None, limit: int = 100, path: str = None) -> list[dict]:
+    """Most recent jobs first, optionally filtered by status"""
+    with _db(path) as conn:
+        if status:
+            rows = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?", (status, limit))
+        else:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+        return [_row_to_job(row) for row in rows.fetchall()]
+
+
+def blob_refs(path: str = None) -> set:
+    """Blob refs in job payloads and results, for blobstore.collect_garbage()"""
+    refs = set()
+    with _db(path) as conn:
+        for row in conn.execute("SELECT payload, result FROM jobs"):
+            refs |= blobstore.refs_in(row["payload"]) | blobstore.refs_in(row["result"])
+    return refs
+
+
+def heartbeat(job_id: int, worker: str, path: str = None) -> bool:
+    """Mark a running job as still alive; False if it is no longer running on this worker"""
+    with _db(path) as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET updated_at = ? WHERE id = ? AND status = 'running' AND worker = ?",
+            (time.time(), job_id, worker),
+        )
+        return cursor.rowcount == 1
+
+
+def requeue_stale(timeout: float = 900, max_attempts: int = 3, worker: str = None, path: str = None) -> int:
+    """Return 'running' jobs whose worker went quiet to the queue (or fail them after max_attempts).
+
+    With `worker`, every running job of that worker is returned regardless of its last heartbeat
+    (the worker is known to be dead).
+    """
+    cutoff = time.time() - timeout
+    condition, params = "status = 'running' AND updated_at < ?", [cutoff]
+    if worker is not None:
+        condition, params = "status = 'running' AND worker = ?", [worker]
+    with _db(path) as conn:
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', error = 'worker lost too many times', updated_at = ? "
+            f"WHERE {condition} AND attempts >= ?",
+            [time.time()] + params + [max_attempts],
+        )
+        cursor = conn.execute(
+            f"UPDATE jobs SET status = 'queued', worker = NULL, updated_at = ? WHERE {condition}",
+            [time.time()] + params,
+        )
+        return cursor.rowcount
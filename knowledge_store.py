@@ -0,0 +1,220 @@
+# knowledge_store.py
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+from contextlib import contextmanager
+
+import blobstore
+
+# Past investigations keyed by a normalized stack-trace signature. Each investigation's
+# tokens (exception types, in-app frames, message words) are kept in an inverted index,
+# so the nearest past investigations of a new error are found with one indexed query and
+# ranked by Jaccard similarity of the token sets.
+KNOWLEDGE_DB = os.getenv("BUGHUNTER_KNOWLEDGE_DB", os.path.join(".bughunter", "knowledge.db"))
+
+# Similarity needed to reuse a verified fix outright, and to seed the fix prompt with one
+REUSE_SCORE = float(os.getenv("BUGHUNTER_RECALL_REUSE_SCORE", "0.9"))
+SEED_SCORE = float(os.getenv("BUGHUNTER_RECALL_SEED_SCORE", "0.5"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS investigations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    repo TEXT NOT NULL,
+    error_id TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    exception_type TEXT,
+    n_tokens INTEGER NOT NULL,
+    relevant_files TEXT NOT NULL DEFAULT '{}',
+    fix TEXT NOT NULL DEFAULT '{}',
+    verdict TEXT NOT NULL DEFAULT 'unverified',
+    pr_url TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (repo, error_id)
+);
+CREATE INDEX IF NOT EXISTS investigations_signature ON investigations(repo, signature);
+CREATE TABLE IF NOT EXISTS signature_tokens (
+    token TEXT NOT NULL,
+    investigation_id INTEGER NOT NULL,
+    PRIMARY KEY (token, investigation_id)
+) WITHOUT ROWID;
+"""
+
+# Frames deeper than this add noise (framework internals) rather than identity
+MAX_FRAMES = 12
+
+
+def connect(path: str = None) -> sqlite3.Connection:
+    path = path or KNOWLEDGE_DB
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+@contextmanager
+def _db(path: str = None):
+    conn = connect(path)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def _repo_key(repo_url: str) -> str:
+    repo = repo_url or ""
+    for prefix in ("https://github.com/", "http://github.com/"):
+        if repo.startswith(prefix):
+            repo = repo[len(prefix):]
+    return repo.replace(".git", "").strip("/").lower()
+
+
+def _frame_key(frame: dict) -> str:
+    location = frame.get("module") or frame.get("filename") or frame.get("absPath") or "?"
+    # Drop per-deploy noise: absolute prefixes, hashes and version numbers in paths
+    location = re.sub(r"^.*/(site-packages|dist-packages|node_modules)/", "", location)
+    location = re.sub(r"[0-9a-f]{8,}|\d+", "#", location.lower())
+    return f"{location}:{frame.get('function') or '?'}"
+
+
+def _exception_values(event: dict) -> list[dict]:
+    values = (event.get("exception") or {}).get("values") or []
+    if not values and event.get("stacktrace"):
+        values = [{"type": event.get("type"), "value": event.get("message"), "stacktrace": event["stacktrace"]}]
+    return values
+
+
+def _frames(value: dict) -> list[dict]:
+    return (value.get("stacktrace") or {}).get("frames") or []
+
+
+def has_frames(event: dict) -> bool:
+    """Whether the event carries a stack trace at all (message-only events do not)"""
+    return any(_frames(value) for value in _exception_values(event))
+
+
+def signature(event: dict):
+    """(signature hash, token set) for a pruned Sentry event.
+
+    The hash is only set when the event has in-app frames; without them exception type
+    and message say too little to call two events the same, so only the tokens are compared.
+    """
+    values = _exception_values(event)
+    exception_types = [v.get("type") or "" for v in values]
+    if not any(exception_types):
+        exception_types = [(event.get("metadata") or {}).get("type") or event.get("type") or event.get("title") or ""]
+
+    frames = []
+    has_in_app = False
+    for value in values:
+        value_frames = _frames(value)
+        in_app = [f for f in value_frames if f.get("inApp")]
+        has_in_app = has_in_app or bool(in_app)
+        # Innermost frames identify the bug best; Sentry lists them last
+        frames.extend(_frame_key(f) for f in (in_app or value_frames)[-MAX_FRAMES:])
+
+    message = " ".join(v.get("value") or "" for v in values) or (event.get("metadata") or {}).get("value") or event.get("message") or ""
+    # Numbers, ids and quoted values differ between occurrences of the same error
+    message = re.sub(r"'[^']*'|\"[^\"]*\"|0x[0-9a-f]+|\d+", " ", message.lower())
+
+    tokens = {f"exc:{t}" for t in exception_types if t}
+    tokens.update(f"frame:{f}" for f in frames)
+    tokens.update(f"msg:{w}" for w in re.findall(r"[a-z_]{3,}", message))
+    digest = hashlib.sha256(json.dumps([exception_types, frames]).encode("utf-8")).hexdigest() if has_in_app else ""
+    return digest, tokens
+
+
+def record(repo_url: str, error_id: str, event: dict, relevant_files: dict = None, fix: dict = None,
+           verdict: str = None, pr_url: str = None, path: str = None) -> int:
+    """Insert or update the investigation of an issue; fields left as None keep their stored value"""
+    digest, tokens = signature(event)
+    values = _exception_values(event)
+    now = time.time()
+    with _db(path) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                """INSERT INTO investigations (repo, error_id, signature, exception_type, n_tokens, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(repo, error_id) DO UPDATE SET
+                       signature = excluded.signature, exception_type = excluded.exception_type,
+                       n_tokens = excluded.n_tokens, updated_at = excluded.updated_at""",
+                (_repo_key(repo_url), str(error_id), digest, values[0].get("type") if values else None,
+                 len(tokens), now, now),
+            )
+            investigation_id = conn.execute(
+                "SELECT id FROM investigations WHERE repo = ? AND error_id = ?", (_repo_key(repo_url), str(error_id))
+            ).fetchone()["id"]
+            conn.execute(
+                """UPDATE investigations SET
+                       relevant_files = COALESCE(?, relevant_files), fix = COALESCE(?, fix),
+                       verdict = COALESCE(?, verdict), pr_url = COALESCE(?, pr_url)
+                   WHERE id = ?""",
+                (json.dumps(relevant_files) if relevant_files is not None else None,
+                 json.dumps(fix) if fix is not None else None, verdict, pr_url, investigation_id),
+            )
+            conn.execute("DELETE FROM signature_tokens WHERE investigation_id = ?", (investigation_id,))
+            conn.executemany(
+                "INSERT INTO signature_tokens (token, investigation_id) VALUES (?, ?)",
+                [(token, investigation_id) for token in tokens],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    return investigation_id
+
+
+def set_verdict(repo_url: str, error_id: str, verdict: str, path: str = None):
+    """Overwrite the sandbox verdict of a stored investigation (e.g. its fix stopped working)"""
+    with _db(path) as conn:
+        conn.execute(
+            "UPDATE investigations SET verdict = ?, updated_at = ? WHERE repo = ? AND error_id = ?",
+            (verdict, time.time(), _repo_key(repo_url), str(error_id)),
+        )
+
+
+def find_similar(repo_url: str, event: dict, min_score: float = SEED_SCORE, limit: int = 3,
+                 path: str = None) -> list[dict]:
+    """Past investigations of the repo that have a fix, best match first, with a 0-1 `score`"""
+    digest, tokens = signature(event)
+    if not tokens:
+        return []
+    with _db(path) as conn:
+        rows = conn.execute(
+            f"""SELECT i.*, COUNT(*) AS shared
+                FROM signature_tokens t JOIN investigations i ON i.id = t.investigation_id
+                WHERE t.token IN ({', '.join('?' for _ in tokens)}) AND i.repo = ? AND i.fix != '{{}}'
+                GROUP BY i.id""",
+            list(tokens) + [_repo_key(repo_url)],
+        ).fetchall()
+    matches = []
+    for row in rows:
+        # Identical signatures (same exception types and in-app frames) count as a full match
+        score = 1.0 if digest and row["signature"] == digest else row["shared"] / (len(tokens) + row["n_tokens"] - row["shared"])
+        if score < min_score:
+            continue
+        match = dict(row)
+        match.pop("shared")
+        match["relevant_files"] = json.loads(match["relevant_files"])
+        match["fix"] = json.loads(match["fix"])
+        match["score"] = score
+        matches.append(match)
+    # Prefer verified fixes among equally close matches, then the most recent one
+    matches.sort(key=lambda m: (m["score"], m["verdict"] == "passed", m["updated_at"]), reverse=True)
+    return matches[:limit]
+
+
+def blob_refs(path: str = None) -> set:
+    """Blob refs of stored fixes, for blobstore.collect_garbage()"""
+    refs = set()
+    with _db(path) as conn:
+        for row in conn.execute("SELECT fix FROM investigations"):
+            refs |= blobstore.refs_in(row["fix"])
+    return refs
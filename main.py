@@ -1,11 +1,56 @@
 # main.py
 import streamlit as st
-from agent import app, AgentState
-from tools import get_sentry_issues
+from agent import get_app, AgentState, build_initial_state, render_fix_markdown
+import blobstore
+import job_queue
+import issue_store
+import tracing
+from providers import get_provider
+import time
 import os
 
 st.title("🪲 BugHunter Agent ")
 
+# Expose /metrics for Prometheus when BUGHUNTER_METRICS_PORT is set
+tracing.serve_metrics()
+
+# Launch the pooled browsers (with the repo page open) in the background while the
+# user picks an issue; the pool is built once per process and reused across reruns
+if os.getenv("BUGHUNTER_BROWSER_PREWARM", "1") != "0":
+    get_provider("browser_pool")
+
+# Performance panel: waterfall of one investigation and p50/p95 per stage across runs
+with st.sidebar:
+    st.subheader("⏱️ Performance")
+    if not tracing.is_enabled():
+        st.caption("Tracing is disabled. Set BUGHUNTER_TRACE=1 to record investigations.")
+    else:
+        traces = tracing.load_traces()
+        if not traces:
+            st.caption("No traces recorded yet.")
+        else:
+            trace_id = st.selectbox("Investigation trace", options=list(traces.keys()))
+            st.vega_lite_chart(
+                tracing.waterfall(traces[trace_id]),
+                {
+                    "mark": "bar",
+                    "encoding": {
+                        "y": {"field": "stage", "type": "nominal", "sort": None},
+                        "x": {"field": "start_s", "type": "quantitative", "title": "seconds"},
+                        "x2": {"field": "end_s"},
+                        "color": {"field": "error", "type": "nominal"},
+                        "tooltip": [{"field": "stage"}, {"field": "duration_s", "format": ".3f"}],
+                    },
+                },
+                use_container_width=True,
+            )
+            stats = tracing.stage_percentiles(traces)
+            st.caption(f"Across {len(traces)} investigations")
+            st.dataframe(
+                [{"stage": name, **values} for name, values in sorted(stats.items())],
+                use_container_width=True,
+            )
+
 # GitHub Repository Input
 st.subheader("📦 GitHub Repository")
 repo_url = os.getenv("GITHUB_REPO", "")
@@ -21,154 +66,240 @@ if repo_url:
     st.info(f"Monitoring: {repo_url}")
 
 
+# Investigations queued by the webhook service (worker.py); results are read-only here
+# apart from the approval decision
+st.subheader("🛰️ Webhook Investigations")
+jobs = job_queue.list_jobs(limit=50)
+if not jobs:
+    st.caption("No webhook-driven investigations yet. Run `python worker.py serve` to start the service.")
+else:
+    st.dataframe(
+        [{"job": j["id"], "issue": j["issue_id"], "status": j["status"], "attempts": j["attempts"], "error": j["error"]} for j in jobs],
+        use_container_width=True,
+    )
+    for job in jobs:
+        if job["status"] != "awaiting_approval":
+            continue
+        with st.expander(f"Job {job['id']} · Sentry issue {job['issue_id']} awaiting approval"):
+            result = job["result"] or {}
+            st.markdown(render_fix_markdown(result))
+            st.code(blobstore.get_text(result.get("reproduction_steps_ref", "")), language="text")
+            col1, col2 = st.columns(2)
+            if col1.button("✅ Approve & Create Draft PR", key=f"approve_job_{job['id']}"):
+                from worker import approve_job
+                try:
+                    with st.spinner("Creating PR..."):
+                        state = approve_job(job["id"])
+                except ValueError as e:
+                    st.warning(str(e))
+                else:
+                    if state.get("final_pr_url"):
+                        st.success(f"✅ PR created: {state['final_pr_url']}")
+                    else:
+                        st.error("; ".join(state.get("messages", [])))
+            if col2.button("❌ Reject", key=f"reject_job_{job['id']}"):
+                from worker import reject_job
+                try:
+                    reject_job(job["id"])
+                    st.warning("Fix rejected.")
+                except ValueError as e:
+                    st.warning(str(e))
+
 # Fetch and display Sentry issues
 st.subheader("📋 Sentry Issues")
 
-if st.button("🔄 Fetch Sentry Issues"):
-    org_slug = os.getenv("SENTRY_ORG_SLUG")
-    project_slug = os.getenv("SENTRY_PROJECT_SLUG")
-    
-    if not org_slug:
-        st.error("Please set SENTRY_ORG_SLUG environment variable")
-    else:
-        with st.spinner("Fetching issues from Sentry..."):
-            try:
-                issues = get_sentry_issues(organization_slug=org_slug, project_slug=project_slug if project_slug else None)
-                st.session_state.sentry_issues = issues
-                st.success(f"Found {len(issues)} issues")
-            except Exception as e:
-                st.error(f"Error fetching issues: {str(e)}")
-                st.session_state.sentry_issues = []
-
-# Display issues if available
+@st.cache_resource
+def get_issue_refresher():
+    """One background refresher per Streamlit server process"""
+    refresher = issue_store.IssueRefresher(
+        interval=float(os.getenv("BUGHUNTER_ISSUE_REFRESH_SECONDS", "60")),
+        prefetch_top_n=int(os.getenv("BUGHUNTER_PREFETCH_TOP_N", "10")),
+    )
+    refresher.start()
+    return refresher
+
+PAGE_SIZE = 25
 error_id = None
-if "sentry_issues" in st.session_state and st.session_state.sentry_issues:
-    st.subheader("Select an Issue to Investigate")
-    
-    # Create a list of issue titles for selection
-    issue_options = {}
-    for issue in st.session_state.sentry_issues[:50]:  # Limit to first 50
-        title = issue.get("title", "Unknown Issue")
-        issue_id_val = issue.get("id", "")
-        short_id = issue.get("shortId", "")
-        count = issue.get("count", 0)
-        last_seen = issue.get("lastSeen", "")
-        display_text = f"{short_id}: {title[:60]}... ({count} events)" if len(title) > 60 else f"{short_id}: {title} ({count} events)"
-        issue_options[display_text] = issue_id_val
-    
-    selected_issue = st.selectbox("Choose an issue:", options=list(issue_options.keys()))
-    error_id = issue_options[selected_issue] if selected_issue else None
-    
-    # Show issue details
-    if selected_issue:
-        selected_issue_data = next((i for i in st.session_state.sentry_issues if i.get("id") == error_id), None)
-        if selected_issue_data:
-            with st.expander("Issue Details"):
-                st.json(selected_issue_data)
+
+if not os.getenv("SENTRY_ORG_SLUG"):
+    st.error("Please set SENTRY_ORG_SLUG environment variable")
+else:
+    refresher = get_issue_refresher()
+    col1, col2 = st.columns([3, 1])
+    if refresher.last_refresh:
+        col1.caption(f"Last synced with Sentry {time.strftime('%H:%M:%S', time.localtime(refresher.last_refresh))}")
+    else:
+        col1.caption("Syncing issues from Sentry in the background...")
+    if refresher.last_error:
+        col1.error(f"Error fetching issues: {refresher.last_error}")
+    if col2.button("🔄 Refresh now"):
+        refresher.refresh_now()
+
+    # Search and facets are served from the local index, never from the Sentry API
+    query = st.text_input("Search issues", placeholder="title, culprit or short ID")
+    with st.expander("Filters"):
+        level_counts = issue_store.facet_counts()
+        levels = st.multiselect(
+            "Level", options=list(level_counts), format_func=lambda level: f"{level} ({level_counts[level]})"
+        )
+        culprit = st.text_input("Culprit contains")
+        count_col1, count_col2 = st.columns(2)
+        min_count = count_col1.number_input("Min events", min_value=0, value=0, step=1)
+        max_count = count_col2.number_input("Max events (0 = no limit)", min_value=0, value=0, step=1)
+        seen_after = st.date_input("Last seen on or after", value=None)
+        sort = st.selectbox("Sort by", options=list(issue_store.SORT_COLUMNS), format_func=lambda s: s.replace("_", " "))
+
+    filters = dict(
+        text=query,
+        levels=levels,
+        culprit=culprit,
+        min_count=min_count or None,
+        max_count=max_count or None,
+        seen_after=seen_after.isoformat() if seen_after else None,
+        sort=sort,
+    )
+    _, total = issue_store.search(**filters, limit=0)
+    pages = max(1, -(-total // PAGE_SIZE))
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1) if pages > 1 else 1
+    issues, total = issue_store.search(**filters, limit=PAGE_SIZE, offset=(page - 1) * PAGE_SIZE)
+    st.caption(f"{total} matching issues")
+
+    # Display issues if available
+    if issues:
+        st.subheader("Select an Issue to Investigate")
+        
+        # Only the current page is turned into options, however many issues are stored
+        issue_options = {}
+        for issue in issues:
+            title = issue.get("title", "Unknown Issue")
+            issue_id_val = issue.get("id", "")
+            short_id = issue.get("shortId", "")
+            count = issue.get("count", 0)
+            display_text = f"{short_id}: {title[:60]}... ({count} events)" if len(title) > 60 else f"{short_id}: {title} ({count} events)"
+            issue_options[display_text] = issue_id_val
+        
+        selected_issue = st.selectbox("Choose an issue:", options=list(issue_options.keys()))
+        error_id = issue_options[selected_issue] if selected_issue else None
+        
+        # Show issue details
+        if selected_issue:
+            selected_issue_data = next((i for i in issues if i.get("id") == error_id), None)
+            if selected_issue_data:
+                with st.expander("Issue Details"):
+                    st.json({k: v for k, v in selected_issue_data.items() if not k.startswith("_")})
 
 st.divider()
 
+# Manual investigations run inline so results stream in as nodes finish and the app works
+# without worker.py; only webhook-driven jobs go through the queue
 if st.button("Start Investigation") and error_id:
     if not repo_url:
         st.error("Please enter a GitHub repository URL before starting the investigation.")
         st.stop()
     
-    # Get the full issue data for the selected error
-    selected_issue_data = None
-    if "sentry_issues" in st.session_state and st.session_state.sentry_issues:
-        selected_issue_data = next((i for i in st.session_state.sentry_issues if i.get("id") == error_id), None)
-    
-    # Get detailed Sentry error data
-    from tools import get_sentry_error
-    try:
-        sentry_error_data = get_sentry_error(error_id)
-    except Exception as e:
-        st.error(f"Failed to fetch Sentry error details: {str(e)}")
-        st.stop()
-        sentry_error_data = {}
+    # Use the event prefetched by the refresher when there is one
+    event_ref = issue_store.get_event_ref(error_id)
+    if event_ref:
+        sentry_error_data = blobstore.get_json(event_ref)
+    else:
+        # Get detailed Sentry error data
+        from tools import get_sentry_error
+        try:
+            sentry_error_data = get_sentry_error(error_id)
+        except Exception as e:
+            st.error(f"Failed to fetch Sentry error details: {str(e)}")
+            st.stop()
     
-    config = {"configurable": {"thread_id": "demo"}}
-    initial = {
-        "error_id": error_id, 
-        "repo_url": repo_url,
-        "sentry_data": sentry_error_data,  # Include full Sentry error data
-        "messages": [], 
-        "needs_approval": False,
-        "relevant_files": {}  # Will be populated by sentry_analysis_node
-    }
-
-    for output in app.stream(initial, config, stream_mode="updates"):
-        if "messages" in output:
-            for m in output["messages"]:
-                st.write(m)
+    # Compiled once per process; later reruns reuse the cached graph
+    app = get_app()
+    # One checkpoint thread per issue; drop snapshots from an earlier run of the same issue
+    thread_id = f"investigation-{error_id}"
+    app.checkpointer.delete_thread(thread_id)
+    config = {"configurable": {"thread_id": thread_id}}
+    initial = build_initial_state(error_id, repo_url, sentry_error_data)
+
+    # One trace per investigation; exported to BUGHUNTER_TRACE_DIR when the run ends
+    with tracing.start_trace(error_id=error_id, repo=repo_url):
+        for output in app.stream(initial, config, stream_mode="updates"):
+            if "messages" in output:
+                for m in output["messages"]:
+                    st.write(m)
         
-        # Display relevant files found by browser_use
-        if "sentry_analysis" in output and "relevant_files" in output["sentry_analysis"]:
-            files_data = output["sentry_analysis"]["relevant_files"]
-            if files_data and files_data.get("files"):
-                st.subheader("🔍 Error-causing Files Found by Browser Use")
-                st.write(files_data.get("summary", ""))
-                for file_info in files_data.get("files", []):
-                    with st.expander(f"📄 {file_info.get('path', 'Unknown')}"):
-                        st.write(f"**Reason:** {file_info.get('reason', 'N/A')}")
-                        if file_info.get('line_number'):
-                            st.write(f"**Line Number:** {file_info.get('line_number')}")
-
-        # Display proposed fix from Gemini
-        if "propose_fix" in output and "proposed_fix" in output["propose_fix"]:
-            st.subheader("🔧 Proposed Fix by Anthropic")
-            proposed_fix = output["propose_fix"]["proposed_fix"]
-            st.markdown(proposed_fix)
+            # A verified fix for the same error was found in the knowledge store
+            if "recall" in output and (output["recall"].get("prior_fix") or {}).get("reused"):
+                prior_fix = output["recall"]["prior_fix"]
+                st.subheader("♻️ Reusing a Verified Fix")
+                st.write(f"Issue {prior_fix['error_id']} had the same error (similarity {prior_fix['score']:.2f})"
+                         + (f"; its PR: {prior_fix['pr_url']}" if prior_fix.get("pr_url") else ""))
+                st.markdown(render_fix_markdown(output["recall"]))
+                st.info("⏳ Re-testing the fix in Daytona sandbox...")
+
+            # Display relevant files found by browser_use
+            if "sentry_analysis" in output and "relevant_files" in output["sentry_analysis"]:
+                files_data = output["sentry_analysis"]["relevant_files"]
+                if files_data and files_data.get("files"):
+                    st.subheader("🔍 Error-causing Files Found by Browser Use")
+                    st.write(files_data.get("summary", ""))
+                    for file_info in files_data.get("files", []):
+                        with st.expander(f"📄 {file_info.get('path', 'Unknown')}"):
+                            st.write(f"**Reason:** {file_info.get('reason', 'N/A')}")
+                            if file_info.get('line_number'):
+                                st.write(f"**Line Number:** {file_info.get('line_number')}")
+
+            # Display proposed fix from Gemini
+            if "propose_fix" in output and "fix_edits" in output["propose_fix"]:
+                st.subheader("🔧 Proposed Fix by Anthropic")
+                st.markdown(render_fix_markdown(output["propose_fix"]))
             
-            if output["propose_fix"].get("needs_approval"):
-                st.info("⏳ Fix is being tested in Daytona sandbox...")
+                if output["propose_fix"].get("needs_approval"):
+                    st.info("⏳ Fix is being tested in Daytona sandbox...")
         
-        # Display test results from running fixed code
-        if "daytona" in output and "reproduction_steps" in output["daytona"]:
-            test_results = output["daytona"]["reproduction_steps"]
-            st.subheader("🧪 Test Results (Fixed Code Execution)")
-            if "✅" in test_results:
-                st.success("Fix verified successfully!")
-            elif "❌" in test_results:
-                st.error("Fix verification failed")
-            st.code(test_results, language="text")
+            # Display test results from running fixed code
+            if "daytona" in output and "reproduction_steps_ref" in output["daytona"]:
+                test_results = blobstore.get_text(output["daytona"]["reproduction_steps_ref"])
+                st.subheader("🧪 Test Results (Fixed Code Execution)")
+                if "✅" in test_results:
+                    st.success("Fix verified successfully!")
+                elif "❌" in test_results:
+                    st.error("Fix verification failed")
+                st.code(test_results, language="text")
             
-            # Approval buttons - these will trigger PR creation
-            col1, col2 = st.columns(2)
+                # Approval buttons - these will trigger PR creation
+                col1, col2 = st.columns(2)
             
-            if col1.button("✅ Approve & Create Draft PR", key="approve_btn"):
-                # Update the state to mark as approved and continue
-                st.info("Creating PR...")
+                if col1.button("✅ Approve & Create Draft PR", key="approve_btn"):
+                    # Update the state to mark as approved and continue
+                    st.info("Creating PR...")
                 
-                # Get current state and update it
-                current_state = app.get_state(config)
-                if current_state and current_state.values:
-                    # Update needs_approval to False to proceed
-                    updated_state = {**current_state.values, "needs_approval": False}
-                    # Continue the graph execution from approval node
-                    for pr_output in app.stream(updated_state, config, stream_mode="updates"):
-                        if "create_pr" in pr_output:
-                            pr_data = pr_output["create_pr"]
-                            if pr_data.get("final_pr_url"):
-                                st.success(f"✅ PR created: {pr_data['final_pr_url']}")
-                                st.markdown(f"[View PR on GitHub]({pr_data['final_pr_url']})")
+                    # Get current state and update it
+                    current_state = app.get_state(config)
+                    if current_state and current_state.values:
+                        # Update needs_approval to False to proceed
+                        updated_state = {**current_state.values, "needs_approval": False}
+                        # Continue the graph execution from approval node
+                        for pr_output in app.stream(updated_state, config, stream_mode="updates"):
+                            if "create_pr" in pr_output:
+                                pr_data = pr_output["create_pr"]
+                                if pr_data.get("final_pr_url"):
+                                    st.success(f"✅ PR created: {pr_data['final_pr_url']}")
+                                    st.markdown(f"[View PR on GitHub]({pr_data['final_pr_url']})")
                                 
-                                if pr_data.get("messages"):
-                                    for msg in pr_data["messages"]:
-                                        st.write(msg)
-                            else:
-                                # Show error messages
-                                if pr_data.get("messages"):
-                                    for msg in pr_data["messages"]:
-                                        if "❌" in msg or "Failed" in msg:
-                                            st.error(msg)
-                                        else:
-                                            st.warning(msg)
-                            break
-                else:
-                    st.error("Could not retrieve current state. Please restart the workflow.")
+                                    if pr_data.get("messages"):
+                                        for msg in pr_data["messages"]:
+                                            st.write(msg)
+                                else:
+                                    # Show error messages
+                                    if pr_data.get("messages"):
+                                        for msg in pr_data["messages"]:
+                                            if "❌" in msg or "Failed" in msg:
+                                                st.error(msg)
+                                            else:
+                                                st.warning(msg)
+                                break
+                    else:
+                        st.error("Could not retrieve current state. Please restart the workflow.")
                 
-            if col2.button("❌ Reject", key="reject_btn"):
-                st.warning("Fix rejected. Workflow stopped.")
-                st.stop()
+                if col2.button("❌ Reject", key="reject_btn"):
+                    st.warning("Fix rejected. Workflow stopped.")
+                    st.stop()
         
\ No newline at end of file
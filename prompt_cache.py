@@ -0,0 +1,294 @@
+# prompt_cache.py
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from providers import register_provider
+from tools import get_default_branch_sha, get_file_at_sha, _github_repo_name
+
+# The fix prompt is split into a stable prefix (instructions + repository context at the
+# default branch's head SHA) and a per-issue suffix. The prefix is registered once per
+# repo SHA with the provider's context cache, so batch runs against the same repository
+# only send (and pay for) the suffix. Entries are rebuilt when the head SHA moves or the
+# TTL runs out. Registered cache names are kept in the shared SQLite DB as well, so the
+# Streamlit process and every worker reuse one cache per prefix instead of each paying
+# for its own. Replaced caches are never deleted: a request that picked up the old name
+# just before a refresh may still be using it, so they are left to expire with their TTL.
+PROMPT_CACHE_TTL = int(os.getenv("BUGHUNTER_PROMPT_CACHE_TTL", "3600"))
+SHA_CHECK_SECONDS = float(os.getenv("BUGHUNTER_PROMPT_CACHE_SHA_CHECK", "60"))
+PREFIX_HOT_FILES = int(os.getenv("BUGHUNTER_PREFIX_HOT_FILES", "5"))
+PREFIX_MAX_CHARS = int(os.getenv("BUGHUNTER_PREFIX_MAX_CHARS", "60000"))
+# Shared by the Streamlit process and the worker pool, so the counts live in SQLite
+HOT_FILES_DB = os.getenv("BUGHUNTER_HOT_FILES_DB", os.path.join(".bughunter", "hot_files.db"))
+# Entries are renewed this long before their cache expires, so requests never reference an expired one
+RENEW_MARGIN = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hot_files (
+    repo TEXT NOT NULL,
+    path TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (repo, path)
+);
+CREATE TABLE IF NOT EXISTS prefix_caches (
+    prefix_hash TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+@contextmanager
+def _db():
+    if os.path.dirname(HOT_FILES_DB):
+        os.makedirs(os.path.dirname(HOT_FILES_DB), exist_ok=True)
+    conn = sqlite3.connect(HOT_FILES_DB, timeout=30, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        yield conn
+    finally:
+        conn.close()
+
+
+def record_relevant_files(repo_url: str, paths: list[str]):
+    """Count how often files come up for a repo; the most frequent ones go into the prefix"""
+    paths = [p for p in paths if p]
+    if not paths:
+        return
+    repo = _github_repo_name(repo_url)
+    with _db() as conn:
+        conn.executemany(
+            "INSERT INTO hot_files (repo, path, count) VALUES (?, ?, 1) "
+            "ON CONFLICT(repo, path) DO UPDATE SET count = count + 1",
+            [(repo, path) for path in paths],
+        )
+
+
+def hot_files(repo_url: str, n: int = PREFIX_HOT_FILES) -> list[str]:
+    with _db() as conn:
+        # Ties broken by path so the prefix is identical across processes
+        rows = conn.execute(
+            "SELECT path FROM hot_files WHERE repo = ? ORDER BY count DESC, path LIMIT ?",
+            (_github_repo_name(repo_url), n),
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def _prefix_hash(prefix: str) -> str:
+    return hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+
+
+def shared_cache(prefix: str):
+    """(name, expires_at) of a cache another process registered for this exact prefix, if still alive"""
+    with _db() as conn:
+        row = conn.execute(
+            "SELECT name, expires_at FROM prefix_caches WHERE prefix_hash = ? AND expires_at > ?",
+            (_prefix_hash(prefix), time.time() + RENEW_MARGIN),
+        ).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def share_cache(prefix: str, name: str, expires_at: float):
+    with _db() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO prefix_caches (prefix_hash, name, expires_at) VALUES (?, ?, ?)",
+            (_prefix_hash(prefix), name, expires_at),
+        )
+        conn.execute("DELETE FROM prefix_caches WHERE expires_at <= ?", (time.time(),))
+
+
+def forget_cache(name: str):
+    with _db() as conn:
+        conn.execute("DELETE FROM prefix_caches WHERE name = ?", (name,))
+
+
+def is_missing_cache_error(error: Exception) -> bool:
+    """Whether a model request failed because its cached content expired or was deleted"""
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    text = str(error).lower()
+    return code in (403, 404) or ("cache" in text and any(
+        word in text for word in ("not found", "expired", "does not exist", "permission")
+    ))
+
+
+def build_prefix(instructions: str, repo_url: str, sha: str) -> str:
+    """Instructions followed by the repo's hot files at `sha`, capped at PREFIX_MAX_CHARS"""
+    repo = _github_repo_name(repo_url)
+    parts = [instructions.strip(), f"REPOSITORY CONTEXT: {repo} at commit {sha}"]
+    budget = PREFIX_MAX_CHARS - sum(len(p) for p in parts)
+    for path in hot_files(repo_url):
+        try:
+            content = get_file_at_sha(repo_url, path, sha)
+        except Exception as e:
+            print(f"Could not load {path} at {sha[:8]} for the prompt prefix: {e}")
+            continue
+        if not content:
+            continue
+        block = f"--- {path} ---\n{content}"
+        if len(block) > budget:
+            break
+        parts.append(block)
+        budget -= len(block)
+    return "\n\n".join(parts)
+
+
+class GeminiContextCache:
+    """Registers prefixes with Gemini's explicit context caching (google-genai caches API)"""
+
+    def __init__(self, model: str = "gemini-2.5-flash"):
+        self.model = model
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            from google import genai
+            self._client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY"))
+        return self._client
+
+    def create(self, prefix: str, ttl: int, tools: list) -> str:
+        from google.genai import types
+        from langchain_core.utils.function_calling import convert_to_openai_tool
+
+        # Gemini rejects requests that set tools alongside cached content, so the
+        # tools (and forced tool choice) are part of the cache itself
+        functions = [convert_to_openai_tool(tool)["function"] for tool in tools]
+        config = types.CreateCachedContentConfig(
+            system_instruction=prefix,
+            tools=[types.Tool(function_declarations=[
+                types.FunctionDeclaration(
+                    name=fn["name"],
+                    description=fn.get("description", ""),
+                    parameters_json_schema=fn["parameters"],
+                )
+                for fn in functions
+            ])],
+            tool_config=types.ToolConfig(function_calling_config=types.FunctionCallingConfig(
+                mode="ANY", allowed_function_names=[fn["name"] for fn in functions],
+            )),
+            ttl=f"{ttl}s",
+            display_name=f"bughunter-{_prefix_hash(prefix)[:12]}",
+        )
+        return self._get_client().caches.create(model=self.model, config=config).name
+
+
+class LocalContextCache:
+    """In-process stand-in for GeminiContextCache used by the benchmark and tests"""
+
+    def __init__(self):
+        self.entries = {}
+        self.created = 0
+
+    def create(self, prefix: str, ttl: int, tools: list) -> str:
+        name = f"local/{_prefix_hash(prefix)[:16]}"
+        self.entries[name] = prefix
+        self.created += 1
+        return name
+
+
+class PromptPrefixCache:
+    """Per-repo prefix entries keyed by head SHA, registered with `backend` when there is one.
+
+    get() returns {"sha", "prefix", "name", ...}; `name` is None when the prefix could
+    not be registered (no backend, prefix below the provider's minimum size, API error),
+    in which case callers send the prefix inline.
+    """
+
+    def __init__(self, backend=None, ttl: int = PROMPT_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()  # guards _entries and _refresh_locks only
+        self._refresh_locks = {}  # key -> lock held while that entry is being refreshed
+
+    def _fresh(self, key):
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry and now < entry["expires_at"] and now - entry["checked_at"] < SHA_CHECK_SECONDS:
+            return entry
+        return None
+
+    def get(self, repo_url: str, instructions: str, tools: list) -> dict:
+        key = (_github_repo_name(repo_url), hashlib.sha256(instructions.encode("utf-8")).hexdigest())
+        with self._lock:
+            entry = self._fresh(key)
+            if entry:
+                return entry
+            entry = self._entries.get(key)
+            refresh_lock = self._refresh_locks.setdefault(key, threading.Lock())
+        # GitHub and cache API calls happen outside self._lock. While another call refreshes
+        # this entry, callers keep using the current one if it has not expired, and only
+        # wait when there is nothing usable yet.
+        usable = entry is not None and time.time() < entry["expires_at"]
+        if not refresh_lock.acquire(blocking=not usable):
+            return entry
+        try:
+            return self._refresh(key, repo_url, instructions, tools)
+        finally:
+            refresh_lock.release()
+
+    def _refresh(self, key, repo_url: str, instructions: str, tools: list) -> dict:
+        with self._lock:
+            # Someone else may have refreshed it while we waited for the refresh lock
+            entry = self._fresh(key)
+            if entry:
+                return entry
+            entry = self._entries.get(key)
+        now = time.time()
+        try:
+            sha = get_default_branch_sha(repo_url)
+        except Exception as e:
+            print(f"Could not resolve head SHA for {repo_url}: {e}")
+            sha = entry["sha"] if entry else "unknown"
+        if entry and entry["sha"] == sha and now < entry["expires_at"]:
+            with self._lock:
+                entry["checked_at"] = now
+            return entry
+
+        # New repo, head moved, or TTL ran out: build a new prefix and register it, unless
+        # another process already has. The previous cache is left to expire on its own.
+        prefix = build_prefix(instructions, repo_url, sha)
+        name, expires_at = None, now + self.ttl
+        if self.backend is not None:
+            shared = shared_cache(prefix)
+            if shared:
+                name, expires_at = shared
+            else:
+                try:
+                    name = self.backend.create(prefix, self.ttl, tools)
+                    share_cache(prefix, name, expires_at)
+                except Exception as e:
+                    print(f"Prompt prefix not cached, sending it inline: {e}")
+        new_entry = {
+            "sha": sha,
+            "prefix": prefix,
+            "name": name,
+            "expires_at": max(expires_at - RENEW_MARGIN, now + 1),
+            "checked_at": now,
+        }
+        with self._lock:
+            self._entries[key] = new_entry
+        return new_entry
+
+    def discard(self, entry: dict):
+        """Drop a cache that turned out to be gone, so the next get() registers a new one"""
+        with self._lock:
+            for key, current in list(self._entries.items()):
+                if current is entry:
+                    del self._entries[key]
+        if entry["name"]:
+            forget_cache(entry["name"])
+
+
+def _make_prompt_cache():
+    mode = os.getenv("BUGHUNTER_PROMPT_CACHE", "gemini").lower()
+    if mode == "local":
+        return PromptPrefixCache(LocalContextCache())
+    if mode == "off":
+        return PromptPrefixCache(None)
+    return PromptPrefixCache(GeminiContextCache())
+
+register_provider("prompt_cache", _make_prompt_cache, replace=False)
@@ -0,0 +1,40 @@
+# providers.py
+import threading
+
+# Registry of lazily built backends (Gemini client, Daytona client, ...).
+# Modules register a zero-argument factory at import time, which is cheap; the factory
+# (and the heavy import inside it) runs on the first get_provider() call and the
+# result is shared for the rest of the process. Tests and the benchmark swap in fakes
+# by registering a different factory under the same name.
+_factories = {}
+_instances = {}
+_lock = threading.RLock()
+
+
+def register_provider(name: str, factory, replace: bool = True):
+    """Register the factory for a backend; replacing it drops any instance already built"""
+    with _lock:
+        if not replace and name in _factories:
+            return
+        _factories[name] = factory
+        _instances.pop(name, None)
+
+
+def get_provider(name: str):
+    """Return the shared instance for a backend, building it on first use"""
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+    with _lock:
+        if name not in _instances:
+            if name not in _factories:
+                raise KeyError(f"No provider registered for {name!r}")
+            _instances[name] = _factories[name]()
+        return _instances[name]
+
+
+def reset_providers(*names: str):
+    """Drop built instances (all of them if no names are given) so the next call rebuilds"""
+    with _lock:
+        for name in names or list(_instances):
+            _instances.pop(name, None)
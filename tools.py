@@ -1,30 +1,89 @@
 # tools.py
 import os
 import requests
-from sentry_sdk.api import capture_message
 import json
-import asyncio
 import base64
-from browser_use import Agent, ChatGoogle
-from daytona import Daytona, DaytonaConfig
+import time
+from providers import register_provider, get_provider
+from tracing import span, record_span
 
-async def _run_browser_task(task: str) -> str:
-    # Set up LLM for the agent (using Google Gemini)
-    llm = ChatGoogle(
+# browser_use and daytona are slow to import, so they are only loaded by these
+# factories the first time a browser task or sandbox is actually needed.
+def _make_browser_llm():
+    from browser_use import ChatGoogle
+    return ChatGoogle(
         model="gemini-2.5-flash",
         api_key=os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
     )
-    # Create agent with the task
+
+def _make_daytona():
+    from daytona import Daytona, DaytonaConfig
+    config = DaytonaConfig(
+        api_key=os.getenv("DAYTONA_API_KEY"),
+        api_url=os.getenv("DAYTONA_API_URL", "https://app.daytona.io/api"),
+        target=os.getenv("DAYTONA_TARGET", "us")
+    )
+    return Daytona(config)
+
+def _make_browser_pool():
+    from browser_pool import BrowserPool
+    # Keep the monitored repository open in every pooled browser
+    repo = os.getenv("GITHUB_REPO", "")
+    warm_urls = [f"https://github.com/{_github_repo_name(repo)}"] if repo else []
+    pool = BrowserPool(warm_urls=warm_urls)
+    pool.warm()
+    return pool
+
+register_provider("browser_llm", _make_browser_llm, replace=False)
+register_provider("daytona", _make_daytona, replace=False)
+register_provider("browser_pool", _make_browser_pool, replace=False)
+
+def _browser_step_hooks():
+    """browser_use on_step_start/on_step_end hooks recording one browser.step span per step.
+
+    browser_use increments agent.state.n_steps inside step(), between the two hooks, so
+    the start is remembered here instead of being looked up by step number.
+    """
+    started = {}
+
+    async def on_step_start(agent):
+        started["step"], started["ns"] = agent.state.n_steps, time.time_ns()
+
+    async def on_step_end(agent):
+        if "ns" in started:
+            record_span("browser.step", started.pop("ns"), time.time_ns(), step=started.pop("step"))
+
+    return on_step_start, on_step_end
+
+async def _run_browser_task(task: str, browser_session=None) -> str:
+    from browser_use import Agent
+    # Create agent with the task, sharing the process-wide Gemini client and a pooled browser
     agent = Agent(
         task=task,
-        llm=llm,
+        llm=get_provider("browser_llm"),
+        browser_session=browser_session,
     )
-    # Run the agent
-    result = await agent.run()
+    on_step_start, on_step_end = _browser_step_hooks()
+
+    with span("browser.task") as task_span:
+        # Run the agent
+        result = await agent.run(on_step_start=on_step_start, on_step_end=on_step_end)
+        task_span.set(steps=agent.state.n_steps)
     # Extract the final result
     output = result.final_result()
     return output if output else ""
 
+def _browse(task: str) -> str:
+    """Run a browser_use task on a pooled browser session (blocking)"""
+    return get_provider("browser_pool").run(lambda session: _run_browser_task(task, session))
+
+def _traced_request(backend: str, method: str, url: str, **kwargs) -> requests.Response:
+    """Send an HTTP request to Sentry/GitHub inside a tracing span"""
+    with span(f"{backend}.request", method=method, url=url.split("?")[0]) as request_span:
+        response = requests.request(method, url, **kwargs)
+        request_span.set(status_code=response.status_code)
+    return response
+
 def search_github(repo: str, query: str) -> list[dict]:
     task = f"""
     You are a precise GitHub researcher. Do exactly this and nothing else:
@@ -38,8 +97,7 @@ def search_github(repo: str, query: str) -> list[dict]:
     ]
     If login wall appears, stop and return empty list [].
     """
-    # Run the async task synchronously
-    output = asyncio.run(_run_browser_task(task))
+    output = _browse(task)
     
     try:
         issues = json.loads(output)
@@ -114,8 +172,7 @@ def find_files_from_sentry_issue(repo_url: str, sentry_issue_data: dict) -> dict
     If you cannot find specific files, return an empty files array but still provide a summary based on the error type.
     """
     
-    # Run the async task synchronously
-    output = asyncio.run(_run_browser_task(task))
+    output = _browse(task)
     
     try:
         result = json.loads(output)
@@ -130,8 +187,19 @@ def find_files_from_sentry_issue(repo_url: str, sentry_issue_data: dict) -> dict
         }
 
 
+def _sentry_api_url() -> str:
+    # Overridable so the benchmark harness can point at a local stand-in
+    return os.getenv("SENTRY_API_URL", "https://sentry.io/api/0").rstrip("/")
+
+def _github_api_url() -> str:
+    return os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+
 def get_sentry_issues(organization_slug: str = None, project_slug: str = None, limit: int = 50) -> list[dict]:
     """Fetch Sentry issues from an organization/project"""
+    return next(iter_sentry_issue_pages(organization_slug, project_slug, limit=limit, max_pages=1), [])
+
+def iter_sentry_issue_pages(organization_slug: str = None, project_slug: str = None, limit: int = 100, max_pages: int = None):
+    """Yield pages of unresolved Sentry issues, following the Link header cursor"""
     org_slug = organization_slug or os.getenv("SENTRY_ORG_SLUG")
     project_slug = project_slug or os.getenv("SENTRY_PROJECT_SLUG")
     
@@ -140,9 +208,9 @@ def get_sentry_issues(organization_slug: str = None, project_slug: str = None, l
     
     # Build the URL - if project is specified, use project-specific endpoint
     if project_slug:
-        url = f"https://sentry.io/api/0/projects/{org_slug}/{project_slug}/issues/"
+        url = f"{_sentry_api_url()}/projects/{org_slug}/{project_slug}/issues/"
     else:
-        url = f"https://sentry.io/api/0/organizations/{org_slug}/issues/"
+        url = f"{_sentry_api_url()}/organizations/{org_slug}/issues/"
     
     headers = {"Authorization": f"Bearer {os.getenv('SENTRY_TOKEN')}"}
     params = {
@@ -151,32 +219,80 @@ def get_sentry_issues(organization_slug: str = None, project_slug: str = None, l
         "limit": limit
     }
     
-    r = requests.get(url, headers=headers, params=params)
-    r.raise_for_status()
-    return r.json()
+    pages = 0
+    while True:
+        r = _traced_request("sentry", "GET", url, headers=headers, params=params)
+        r.raise_for_status()
+        yield r.json()
+        pages += 1
+        # Sentry marks the last page with results="false" on the next link
+        next_link = r.links.get("next", {})
+        if next_link.get("results") != "true" or not next_link.get("cursor"):
+            break
+        if max_pages and pages >= max_pages:
+            break
+        params["cursor"] = next_link["cursor"]
 
 def get_sentry_error(error_id: str) -> dict:
     """Get details of a specific Sentry error/issue"""
-    url = f"https://sentry.io/api/0/issues/{error_id}/events/"
+    url = f"{_sentry_api_url()}/issues/{error_id}/events/"
     headers = {"Authorization": f"Bearer {os.getenv('SENTRY_TOKEN')}"}
-    r = requests.get(url, headers=headers)
+    r = _traced_request("sentry", "GET", url, headers=headers)
     r.raise_for_status()
     return r.json()[0]  # latest event
 
+# Only these parts of a Sentry event are read by the graph nodes
+_SENTRY_EVENT_FIELDS = ("id", "eventID", "groupID", "title", "type", "message", "culprit", "platform")
+_SENTRY_FRAME_FIELDS = ("filename", "absPath", "module", "function", "lineNo", "inApp", "context")
+# Webhook payloads carry the raw event JSON, whose keys are snake_case; the REST API uses camelCase
+_SENTRY_SNAKE_CASE_KEYS = {"event_id": "eventID", "abs_path": "absPath", "lineno": "lineNo", "in_app": "inApp"}
+
+def _prune_frame(frame: dict) -> dict:
+    frame = {_SENTRY_SNAKE_CASE_KEYS.get(k, k): v for k, v in frame.items()}
+    if "context" not in frame and frame.get("context_line") is not None and frame.get("lineNo"):
+        # Rebuild the REST API's [[line number, source line], ...] from pre/post context
+        pre, post = frame.get("pre_context") or [], frame.get("post_context") or []
+        first = frame["lineNo"] - len(pre)
+        lines = pre + [frame["context_line"]] + post
+        frame["context"] = [[first + i, line] for i, line in enumerate(lines)]
+    return {k: frame[k] for k in _SENTRY_FRAME_FIELDS if k in frame}
+
+def prune_sentry_event(event: dict) -> dict:
+    """Reduce a Sentry event to the fields the nodes use (drops breadcrumbs, frame vars, contexts, sdk...)"""
+    def prune_stacktrace(stacktrace):
+        if not stacktrace:
+            return stacktrace
+        return {"frames": [_prune_frame(frame) for frame in stacktrace.get("frames") or []]}
+
+    event = {_SENTRY_SNAKE_CASE_KEYS.get(k, k): v for k, v in event.items()}
+    pruned = {k: event[k] for k in _SENTRY_EVENT_FIELDS if k in event}
+    metadata = event.get("metadata") or {}
+    if metadata:
+        pruned["metadata"] = {k: metadata[k] for k in ("type", "value", "filename", "function") if k in metadata}
+    exception_values = (event.get("exception") or {}).get("values") or []
+    if exception_values:
+        pruned["exception"] = {"values": [
+            {
+                "type": value.get("type"),
+                "value": value.get("value"),
+                "stacktrace": prune_stacktrace(value.get("stacktrace")),
+            }
+            for value in exception_values
+        ]}
+    if event.get("stacktrace"):
+        pruned["stacktrace"] = prune_stacktrace(event["stacktrace"])
+    return pruned
+
 #daytona tools
-def create_daytona_workspace_with_fix(repo_url: str, file_to_fix: str = None, fixed_code: str = None, proposed_fix: str = "", branch: str = "main") -> tuple:
+def create_daytona_workspace_with_fix(repo_url: str, edits: list[dict] = None, branch: str = "main") -> tuple:
     """Create Daytona workspace, apply the fix, and run the code to verify it works"""
-    # Configure Daytona client
-    config = DaytonaConfig(
-        api_key=os.getenv("DAYTONA_API_KEY"),
-        api_url=os.getenv("DAYTONA_API_URL", "https://app.daytona.io/api"),
-        target=os.getenv("DAYTONA_TARGET", "us")
-    )
-    daytona = Daytona(config)
-    # Create a new sandbox
-    sandbox = daytona.create()
-    # Wait for sandbox to be ready before cloning
-    sandbox.wait_for_sandbox_start(timeout=60)
+    # Daytona client is built once per process
+    daytona = get_provider("daytona")
+    with span("sandbox.create"):
+        # Create a new sandbox
+        sandbox = daytona.create()
+        # Wait for sandbox to be ready before cloning
+        sandbox.wait_for_sandbox_start(timeout=60)
     # Get the home directory path
     home_dir = sandbox.get_user_home_dir()
     print(f"Sandbox home directory: {home_dir}")
@@ -186,18 +302,21 @@ def create_daytona_workspace_with_fix(repo_url: str, file_to_fix: str = None, fi
     print(f"Cloning repository: {repo_name}")
     
     # Clone the repository
-    sandbox.git.clone(url=repo_url, path=".", branch=branch)
+    with span("sandbox.clone", repo=repo_name, branch=branch):
+        sandbox.git.clone(url=repo_url, path=".", branch=branch)
     print("Repository cloned")
     
-    # Apply the fix if we have file path and fixed code
-    if file_to_fix and fixed_code:
+    # Apply the fix: each edit is {"file_path": ..., "content": ...} with the complete new file
+    for edit in edits or []:
+        file_to_fix = edit["file_path"]
         print(f"Applying fix to: {file_to_fix}")
         # Write the fixed code to the file using upload_file
         full_file_path = f"{repo_name}/{file_to_fix}"
         # Convert string to bytes for upload
-        fixed_code_bytes = fixed_code.encode('utf-8')
+        fixed_code_bytes = edit["content"].encode('utf-8')
         # upload_file takes file as first positional argument, then remote_path
-        sandbox.fs.upload_file(fixed_code_bytes, full_file_path)
+        with span("sandbox.apply_fix", path=file_to_fix, bytes=len(fixed_code_bytes)):
+            sandbox.fs.upload_file(fixed_code_bytes, full_file_path)
         print(f"Fixed code written to {full_file_path}")
     
     # Check if requirements.txt exists, then install dependencies and run the application
@@ -205,15 +324,31 @@ def create_daytona_workspace_with_fix(repo_url: str, file_to_fix: str = None, fi
     print("Found requirements.txt, installing dependencies...")
     install_cmd = "pip install -r requirements.txt"
     
-    print("Running application...")
-    response = sandbox.process.exec(
-        command=f"{install_cmd} && python app.py",
-        cwd=repo_name,
-        timeout=120
-    )
+    # Install and run are separate execs so each phase gets its own timing
+    with span("sandbox.install") as install_span:
+        response = sandbox.process.exec(
+            command=install_cmd,
+            cwd=repo_name,
+            timeout=120
+        )
+        install_span.set(exit_code=response.exit_code)
+    install_output = response.result if response.result else ""
+    
+    if response.exit_code == 0:
+        print("Running application...")
+        with span("sandbox.run") as run_span:
+            response = sandbox.process.exec(
+                command="python app.py",
+                cwd=repo_name,
+                timeout=120
+            )
+            run_span.set(exit_code=response.exit_code)
+        run_output = response.result if response.result else ""
+    else:
+        run_output = ""
     
     # Extract output
-    stdout_stderr = response.result if response.result else ""
+    stdout_stderr = "\n".join(part for part in (install_output, run_output) if part)
     
     if response.exit_code != 0:
         output_text = f"❌ Application failed with exit code: {response.exit_code}\n\nOutput:\n{stdout_stderr}"
@@ -226,11 +361,48 @@ def create_daytona_workspace_with_fix(repo_url: str, file_to_fix: str = None, fi
     workspace_id = sandbox.id
     
     # Clean up
-    sandbox.delete()
+    with span("sandbox.delete"):
+        sandbox.delete()
     
     return (workspace_id, output_text)
     
 
+def _github_repo_name(repo: str) -> str:
+    # Accept owner/repo or a full GitHub URL
+    for prefix in ("https://github.com/", "http://github.com/"):
+        if repo.startswith(prefix):
+            repo = repo[len(prefix):]
+    return repo.replace(".git", "").strip("/")
+
+def _github_headers(accept: str = "application/vnd.github.v3+json") -> dict:
+    headers = {"Accept": accept}
+    if os.getenv("GITHUB_TOKEN"):
+        headers["Authorization"] = f"token {os.getenv('GITHUB_TOKEN')}"
+    return headers
+
+def get_default_branch_sha(repo: str) -> str:
+    """SHA of the head commit of the repository's default branch"""
+    repo = _github_repo_name(repo)
+    r = _traced_request(
+        "github", "GET", f"{_github_api_url()}/repos/{repo}/commits/HEAD",
+        headers=_github_headers("application/vnd.github.sha")
+    )
+    r.raise_for_status()
+    return r.text.strip()
+
+def get_file_at_sha(repo: str, path: str, sha: str) -> str:
+    """Raw content of a file at a given commit (empty string if it does not exist there)"""
+    repo = _github_repo_name(repo)
+    r = _traced_request(
+        "github", "GET", f"{_github_api_url()}/repos/{repo}/contents/{path.lstrip('/')}",
+        headers=_github_headers("application/vnd.github.raw"),
+        params={"ref": sha}
+    )
+    if r.status_code == 404:
+        return ""
+    r.raise_for_status()
+    return r.text
+
 def create_draft_pr(repo: str, branch: str, title: str, body: str, file_path: str = None, file_content: str = None) -> tuple:
     """Create a draft PR on GitHub without committing any files - just creates a PR with description"""
     github_token = os.getenv('GITHUB_TOKEN')
@@ -258,13 +430,14 @@ def create_draft_pr(repo: str, branch: str, title: str, body: str, file_path: st
     print(f"Creating PR for repo: {repo}, branch: {branch}")
     print(f"File path: {file_path}, Has content: {bool(file_content)}")
     
+    github_api = _github_api_url()
     headers = {
         "Authorization": f"token {github_token}",
         "Accept": "application/vnd.github.v3+json"
     }
     
     # Step 1: Get the default branch (usually 'main' or 'master')
-    repo_response = requests.get(f"https://api.github.com/repos/{repo}", headers=headers)
+    repo_response = _traced_request("github", "GET", f"{github_api}/repos/{repo}", headers=headers)
     
     if repo_response.status_code != 200:
         error_msg = f"Failed to get repo info: {repo_response.status_code} - {repo_response.text}"
@@ -275,8 +448,8 @@ def create_draft_pr(repo: str, branch: str, title: str, body: str, file_path: st
     print(f"Default branch: {default_branch}")
     
     # Step 2: Get the SHA of the default branch
-    ref_response = requests.get(
-        f"https://api.github.com/repos/{repo}/git/ref/heads/{default_branch}",
+    ref_response = _traced_request(
+        "github", "GET", f"{github_api}/repos/{repo}/git/ref/heads/{default_branch}",
         headers=headers
     )
     if ref_response.status_code != 200:
@@ -288,8 +461,8 @@ def create_draft_pr(repo: str, branch: str, title: str, body: str, file_path: st
     
     # Step 3: Create a new branch
     branch_ref = f"refs/heads/{branch}"
-    create_branch_response = requests.post(
-        f"https://api.github.com/repos/{repo}/git/refs",
+    create_branch_response = _traced_request(
+        "github", "POST", f"{github_api}/repos/{repo}/git/refs",
         json={
             "ref": branch_ref,
             "sha": base_sha
@@ -300,8 +473,8 @@ def create_draft_pr(repo: str, branch: str, title: str, body: str, file_path: st
     if create_branch_response.status_code == 422:
         print(f"Branch {branch} already exists, using existing branch")
         # Branch exists, get its SHA
-        existing_branch = requests.get(
-            f"https://api.github.com/repos/{repo}/git/ref/heads/{branch}",
+        existing_branch = _traced_request(
+            "github", "GET", f"{github_api}/repos/{repo}/git/ref/heads/{branch}",
             headers=headers
         )
         if existing_branch.status_code == 200:
@@ -323,8 +496,8 @@ def create_draft_pr(repo: str, branch: str, title: str, body: str, file_path: st
     print("Creating empty commit to enable PR creation...")
     try:
         # Get the commit object to get its tree SHA
-        commit_obj_response = requests.get(
-            f"https://api.github.com/repos/{repo}/git/commits/{base_sha}",
+        commit_obj_response = _traced_request(
+            "github", "GET", f"{github_api}/repos/{repo}/git/commits/{base_sha}",
             headers=headers
         )
         if commit_obj_response.status_code == 200:
@@ -338,8 +511,8 @@ def create_draft_pr(repo: str, branch: str, title: str, body: str, file_path: st
                 "parents": [base_sha]
             }
             
-            commit_response = requests.post(
-                f"https://api.github.com/repos/{repo}/git/commits",
+            commit_response = _traced_request(
+                "github", "POST", f"{github_api}/repos/{repo}/git/commits",
                 json=commit_data,
                 headers=headers
             )
@@ -347,8 +520,8 @@ def create_draft_pr(repo: str, branch: str, title: str, body: str, file_path: st
             if commit_response.status_code == 201:
                 new_commit_sha = commit_response.json()["sha"]
                 # Update branch to point to new commit
-                update_ref_response = requests.patch(
-                    f"https://api.github.com/repos/{repo}/git/refs/heads/{branch}",
+                update_ref_response = _traced_request(
+                    "github", "PATCH", f"{github_api}/repos/{repo}/git/refs/heads/{branch}",
                     json={"sha": new_commit_sha},
                     headers=headers
                 )
@@ -373,8 +546,8 @@ def create_draft_pr(repo: str, branch: str, title: str, body: str, file_path: st
     
     # Step 5: Check if a PR already exists for this branch
     print(f"Checking for existing PR on branch: {branch}")
-    existing_prs = requests.get(
-        f"https://api.github.com/repos/{repo}/pulls",
+    existing_prs = _traced_request(
+        "github", "GET", f"{github_api}/repos/{repo}/pulls",
         headers=headers,
         params={"head": f"{repo.split('/')[0]}:{branch}", "state": "open"}
     )
@@ -391,8 +564,8 @@ def create_draft_pr(repo: str, branch: str, title: str, body: str, file_path: st
     # Step 6: Create the PR (now that branch has a commit different from base)
     # The PR will show no file changes but will have the title and description
     print(f"Creating PR: {title}")
-    pr_response = requests.post(
-        f"https://api.github.com/repos/{repo}/pulls",
+    pr_response = _traced_request(
+        "github", "POST", f"{github_api}/repos/{repo}/pulls",
         json={
         "title": title,
         "head": branch,
@@ -407,8 +580,8 @@ def create_draft_pr(repo: str, branch: str, title: str, body: str, file_path: st
         error_data = pr_response.json()
         if "already exists" in str(error_data).lower():
             # Try to find the existing PR
-            existing_prs = requests.get(
-                f"https://api.github.com/repos/{repo}/pulls",
+            existing_prs = _traced_request(
+                "github", "GET", f"{github_api}/repos/{repo}/pulls",
                 headers=headers,
                 params={"head": f"{repo.split('/')[0]}:{branch}", "state": "all"}
             )
@@ -0,0 +1,351 @@
+# tracing.py
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Tracing is off unless BUGHUNTER_TRACE is set. When it is off, span() hands out a
+# shared no-op object and traced() calls straight through, so the cost is one flag check.
+_enabled = os.getenv("BUGHUNTER_TRACE", "").lower() in ("1", "true", "yes")
+TRACE_DIR = os.getenv("BUGHUNTER_TRACE_DIR", os.path.join(".bughunter", "traces"))
+SERVICE_NAME = "bughunter"
+
+# (trace_id, span_id) of the span currently open in this context. Code running on other
+# threads only joins a trace if its context was copied from the one that opened it.
+_current = contextvars.ContextVar("bughunter_current_span", default=None)
+
+_lock = threading.Lock()
+# trace_id -> finished span dicts, for traces opened by start_trace and not yet exported.
+# Spans outside a trace (background refreshes, pool warm-up) only feed the stage metrics.
+_spans = {}
+_stage_durations = defaultdict(lambda: deque(maxlen=1000))  # span name -> recent durations (s)
+_stage_totals = defaultdict(lambda: [0, 0.0])  # span name -> [count, sum seconds]
+_metrics_server = None
+
+
+def enable(flag: bool = True):
+    """Turn tracing on or off at runtime"""
+    global _enabled
+    _enabled = flag
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    def __init__(self, name: str, attributes: dict, trace_id: str = None):
+        self.name = name
+        self.attributes = dict(attributes)
+        parent = _current.get()
+        if trace_id or not parent:
+            self.trace_id, self.parent_span_id = trace_id, None
+        else:
+            self.trace_id, self.parent_span_id = parent
+        self.span_id = uuid.uuid4().hex[:16]
+        self.start_ns = 0
+        self.end_ns = 0
+        self.error = None
+        self._token = None
+
+    def set(self, **attributes):
+        """Attach attributes (token counts, status codes, ...) to the span"""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self._token = _current.set((self.trace_id, self.span_id))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        _current.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        _record(self.to_dict())
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def _record(span: dict):
+    duration = (span["end_ns"] - span["start_ns"]) / 1e9
+    with _lock:
+        if span["trace_id"] in _spans:
+            _spans[span["trace_id"]].append(span)
+        _stage_durations[span["name"]].append(duration)
+        totals = _stage_totals[span["name"]]
+        totals[0] += 1
+        totals[1] += duration
+
+
+def span(name: str, **attributes):
+    """Context manager timing one phase, e.g. `with span("sandbox.clone", repo=repo):`"""
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+def record_span(name: str, start_ns: int, end_ns: int, **attributes):
+    """Record a span whose start/end were measured elsewhere (e.g. browser_use step hooks)"""
+    if not _enabled:
+        return
+    s = Span(name, attributes)
+    s.start_ns, s.end_ns = start_ns, end_ns
+    _record(s.to_dict())
+
+
+def traced(name: str = None):
+    """Decorator wrapping a function (typically a graph node) in a span"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(span_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def start_trace(name: str = "investigation", trace_id: str = None, **attributes):
+    """Open the root span of an investigation and export the trace when it closes.
+
+    Yields the trace id (None when tracing is disabled).
+    """
+    if not _enabled:
+        yield None
+        return
+    trace_id = trace_id or uuid.uuid4().hex
+    with _lock:
+        _spans[trace_id] = []
+    try:
+        with Span(name, attributes, trace_id=trace_id):
+            yield trace_id
+    finally:
+        export_trace(trace_id)
+
+
+def get_trace(trace_id: str) -> list:
+    with _lock:
+        return list(_spans.get(trace_id, []))
+
+
+def to_otlp_json(spans: list) -> dict:
+    """Convert span dicts to the OTLP/JSON layout understood by OpenTelemetry collectors"""
+    def attr(key, value):
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    otlp_spans = []
+    for s in spans:
+        otlp_span = {
+            "traceId": s["trace_id"],
+            "spanId": s["span_id"],
+            "name": s["name"],
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(s["start_ns"]),
+            "endTimeUnixNano": str(s["end_ns"]),
+            "attributes": [attr(k, v) for k, v in s["attributes"].items() if v is not None],
+            "status": {"code": 2, "message": s["error"]} if s["error"] else {"code": 1},
+        }
+        if s["parent_span_id"]:
+            otlp_span["parentSpanId"] = s["parent_span_id"]
+        otlp_spans.append(otlp_span)
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [attr("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": otlp_spans}],
+        }]
+    }
+
+
+def from_otlp_json(data: dict) -> list:
+    """Read an exported OTLP/JSON trace back into span dicts"""
+    spans = []
+    for resource_span in data.get("resourceSpans", []):
+        for scope_span in resource_span.get("scopeSpans", []):
+            for s in scope_span.get("spans", []):
+                attributes = {}
+                for a in s.get("attributes", []):
+                    value = a["value"]
+                    if "intValue" in value:
+                        attributes[a["key"]] = int(value["intValue"])
+                    else:
+                        attributes[a["key"]] = next(iter(value.values()))
+                spans.append({
+                    "trace_id": s["traceId"],
+                    "span_id": s["spanId"],
+                    "parent_span_id": s.get("parentSpanId"),
+                    "name": s["name"],
+                    "start_ns": int(s["startTimeUnixNano"]),
+                    "end_ns": int(s["endTimeUnixNano"]),
+                    "attributes": attributes,
+                    "error": s.get("status", {}).get("message"),
+                })
+    return spans
+
+
+def export_trace(trace_id: str, directory: str = None) -> str:
+    """Write a finished trace to <TRACE_DIR>/<trace_id>.json and drop it from memory"""
+    directory = directory or TRACE_DIR
+    with _lock:
+        spans = _spans.pop(trace_id, [])
+    if not spans:
+        return ""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{trace_id}.json")
+    with open(path, "w") as f:
+        json.dump(to_otlp_json(spans), f)
+    return path
+
+
+def load_traces(directory: str = None, limit: int = 200) -> dict:
+    """Load the most recent exported traces as {trace_id: [span dicts]}"""
+    directory = directory or TRACE_DIR
+    if not os.path.isdir(directory):
+        return {}
+    files = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".json")]
+    files.sort(key=os.path.getmtime, reverse=True)
+    traces = {}
+    for path in files[:limit]:
+        try:
+            with open(path) as f:
+                spans = from_otlp_json(json.load(f))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Skipping unreadable trace {path}: {e}")
+            continue
+        if spans:
+            traces[spans[0]["trace_id"]] = spans
+    return traces
+
+
+def waterfall(spans: list) -> list[dict]:
+    """Rows (name, offset, duration in seconds) for a waterfall chart, ordered by start time"""
+    if not spans:
+        return []
+    t0 = min(s["start_ns"] for s in spans)
+    rows = []
+    for s in sorted(spans, key=lambda s: s["start_ns"]):
+        rows.append({
+            "stage": s["name"],
+            "start_s": (s["start_ns"] - t0) / 1e9,
+            "end_s": (s["end_ns"] - t0) / 1e9,
+            "duration_s": (s["end_ns"] - s["start_ns"]) / 1e9,
+            "error": bool(s["error"]),
+        })
+    return rows
+
+
+def _percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def stage_percentiles(traces: dict) -> dict:
+    """p50/p95 duration per span name across the given traces"""
+    durations = defaultdict(list)
+    for spans in traces.values():
+        for s in spans:
+            durations[s["name"]].append((s["end_ns"] - s["start_ns"]) / 1e9)
+    stats = {}
+    for name, values in durations.items():
+        values.sort()
+        stats[name] = {
+            "count": len(values),
+            "p50_s": _percentile(values, 0.50),
+            "p95_s": _percentile(values, 0.95),
+        }
+    return stats
+
+
+def render_prometheus() -> str:
+    """Prometheus text exposition of per-stage durations recorded by this process"""
+    lines = [
+        "# HELP bughunter_stage_duration_seconds Duration of BugHunter pipeline stages",
+        "# TYPE bughunter_stage_duration_seconds summary",
+    ]
+    with _lock:
+        snapshot = {name: (sorted(d), list(_stage_totals[name])) for name, d in _stage_durations.items()}
+    for name, (values, (count, total)) in sorted(snapshot.items()):
+        label = name.replace("\\", "\\\\").replace('"', '\\"')
+        for q in (0.5, 0.95):
+            lines.append(f'bughunter_stage_duration_seconds{{stage="{label}",quantile="{q}"}} {_percentile(values, q):.6f}')
+        lines.append(f'bughunter_stage_duration_seconds_sum{{stage="{label}"}} {total:.6f}')
+        lines.append(f'bughunter_stage_duration_seconds_count{{stage="{label}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port: int = None):
+    """Start a /metrics endpoint on a daemon thread (once per process).
+
+    The port defaults to BUGHUNTER_METRICS_PORT; nothing is started if neither is set.
+    """
+    global _metrics_server
+    port = port or int(os.getenv("BUGHUNTER_METRICS_PORT", "0"))
+    if not port:
+        return None
+    with _lock:
+        if _metrics_server is None:
+            _metrics_server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+            print(f"Serving Prometheus metrics on :{port}/metrics")
+    return _metrics_server
@@ -0,0 +1,296 @@
+# worker.py
+"""Headless BugHunter service driven by Sentry webhooks.
+
+    python worker.py serve --port 8080 --workers 2     # webhook receiver + worker pool
+    python worker.py replay payload.json --url http://localhost:8080/sentry/webhook
+
+The receiver verifies the Sentry-Hook-Signature header, dedupes by issue id and enqueues
+jobs in job_queue.py. Worker processes run the graph up to the approval step and store the
+resulting state; approving or rejecting happens from the Streamlit dashboard.
+
+The serving process supervises the pool: it restarts workers that exit (returning their
+running job to the queue), periodically requeues jobs whose worker stopped sending
+heartbeats, and sweeps unreferenced blobs. With --metrics-port, worker i serves its
+Prometheus stage metrics on metrics_port + i.
+"""
+import os
+import hmac
+import json
+import time
+import signal
+import hashlib
+import argparse
+import threading
+import multiprocessing
+import urllib.request
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import blobstore
+import job_queue
+import tracing
+
+WEBHOOK_PATH = "/sentry/webhook"
+# Running jobs refresh their updated_at this often; --stale-timeout must be well above it
+HEARTBEAT_SECONDS = 60
+SUPERVISE_SECONDS = 5
+
+
+def _normalize_repo_url(repo_url: str) -> str:
+    if repo_url and not repo_url.startswith("http") and "/" in repo_url:
+        return f"https://github.com/{repo_url}"
+    return repo_url
+
+
+def sign_payload(body: bytes, secret: str) -> str:
+    """HMAC-SHA256 hex digest Sentry sends in the Sentry-Hook-Signature header"""
+    return hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(body: bytes, signature: str, secret: str) -> bool:
+    if not secret or not signature:
+        return False
+    return hmac.compare_digest(sign_payload(body, secret), signature)
+
+
+def parse_webhook(resource: str, payload: dict):
+    """Return (issue_id, event or None) for issue-alert and issue webhooks, or (None, None) to ignore"""
+    data = payload.get("data") or {}
+    if resource == "event_alert" and data.get("event"):
+        event = data["event"]
+        return str(event.get("issue_id") or event.get("groupID") or ""), event
+    if resource == "issue" and payload.get("action") in ("created", "unresolved") and data.get("issue"):
+        return str(data["issue"].get("id") or ""), None
+    return None, None
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    secret = ""
+    repo_url = ""
+
+    def _reply(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.split("?")[0] != WEBHOOK_PATH:
+            self._reply(404, {"error": "not found"})
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not verify_signature(body, self.headers.get("Sentry-Hook-Signature", ""), self.secret):
+            self._reply(401, {"error": "invalid signature"})
+            return
+        try:
+            payload = json.loads(body)
+        except json.JSONDecodeError:
+            self._reply(400, {"error": "invalid JSON"})
+            return
+
+        issue_id, event = parse_webhook(self.headers.get("Sentry-Hook-Resource", ""), payload)
+        if not issue_id:
+            self._reply(200, {"status": "ignored"})
+            return
+        # Issue alerts carry the event, so workers can skip the Sentry API round trip
+        job_payload = {"sentry_ref": blobstore.put_json(event)} if event else {}
+        job_id = job_queue.enqueue(issue_id, self.repo_url, job_payload)
+        if job_id is None:
+            self._reply(200, {"status": "duplicate", "issue_id": issue_id})
+        else:
+            print(f"Queued job {job_id} for Sentry issue {issue_id}")
+            self._reply(202, {"status": "queued", "job_id": job_id, "issue_id": issue_id})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_job(job: dict) -> dict:
+    """Run the graph for one job until it reaches the approval step; returns the state to store"""
+    from agent import get_app, build_initial_state
+    from tools import get_sentry_error
+
+    sentry_ref = job["payload"].get("sentry_ref")
+    sentry_event = blobstore.get_json(sentry_ref) if sentry_ref else get_sentry_error(job["issue_id"])
+    app = get_app()
+    config = {"configurable": {"thread_id": f"job-{job['id']}"}}
+    with tracing.start_trace(error_id=job["issue_id"], repo=job["repo_url"], job_id=job["id"]):
+        app.invoke(
+            build_initial_state(job["issue_id"], job["repo_url"], sentry_event),
+            config,
+            interrupt_before=["create_pr"],
+        )
+    state = dict(app.get_state(config).values)
+    # The checkpoint is not needed once the state is in the queue
+    app.checkpointer.delete_thread(config["configurable"]["thread_id"])
+    return state
+
+
+def _heartbeat(job_id: int, worker_name: str, done: threading.Event):
+    while not done.wait(HEARTBEAT_SECONDS):
+        try:
+            job_queue.heartbeat(job_id, worker_name)
+        except Exception as e:
+            print(f"Heartbeat for job {job_id} failed: {e}")
+
+
+def worker_loop(worker_name: str, metrics_port: int = 0, poll_interval: float = 2.0):
+    """Claim and run jobs until SIGTERM/SIGINT"""
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    signal.signal(signal.SIGINT, lambda *_: stopping.append(True))
+    if metrics_port:
+        tracing.serve_metrics(metrics_port)
+    print(f"{worker_name} started")
+    while not stopping:
+        job = job_queue.claim_next(worker_name)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        print(f"{worker_name} running job {job['id']} (issue {job['issue_id']})")
+        # Long investigations keep heartbeating so they are not mistaken for a lost worker
+        done = threading.Event()
+        threading.Thread(target=_heartbeat, args=(job["id"], worker_name, done), daemon=True).start()
+        try:
+            state = run_job(job)
+            job_queue.update(job["id"], "awaiting_approval", result=state)
+        except Exception as e:
+            print(f"Job {job['id']} failed: {e}")
+            job_queue.update(job["id"], "failed", error=str(e))
+        finally:
+            done.set()
+
+
+def approve_job(job_id: int) -> dict:
+    """Create the draft PR for an investigated job (called from the dashboard)"""
+    from agent import create_pr_node
+
+    # Claim the job first so a double click or a second dashboard cannot open the PR twice
+    if not job_queue.transition(job_id, "awaiting_approval", "creating_pr"):
+        raise ValueError(f"Job {job_id} is not awaiting approval")
+    job = job_queue.get_job(job_id)
+    try:
+        update = create_pr_node({**job["result"], "needs_approval": False})
+    except Exception as e:
+        job_queue.update(job_id, "failed", error=str(e))
+        raise
+    state = {**job["result"], **update}
+    if update.get("final_pr_url"):
+        job_queue.update(job_id, "pr_created", result=state)
+    else:
+        job_queue.update(job_id, "failed", result=state, error="; ".join(update.get("messages", [])))
+    return state
+
+
+def reject_job(job_id: int):
+    if not job_queue.transition(job_id, "awaiting_approval", "rejected"):
+        raise ValueError(f"Job {job_id} is not awaiting approval")
+
+
+def _start_worker(index: int, metrics_port: int) -> multiprocessing.Process:
+    process = multiprocessing.Process(
+        target=worker_loop, args=(f"worker-{index}", metrics_port + index if metrics_port else 0), daemon=True,
+    )
+    process.start()
+    return process
+
+
+def serve(port: int, workers: int, stale_timeout: float, metrics_port: int = 0):
+    secret = os.getenv("SENTRY_CLIENT_SECRET", "")
+    if not secret:
+        raise ValueError("SENTRY_CLIENT_SECRET must be set to verify webhook signatures")
+    repo_url = _normalize_repo_url(os.getenv("GITHUB_REPO", ""))
+    if not repo_url:
+        raise ValueError("GITHUB_REPO must be set")
+    if stale_timeout <= 2 * HEARTBEAT_SECONDS:
+        raise ValueError(f"--stale-timeout must be more than {2 * HEARTBEAT_SECONDS}s (two heartbeats)")
+
+    processes = [_start_worker(i, metrics_port) for i in range(workers)]
+
+    WebhookHandler.secret = secret
+    WebhookHandler.repo_url = repo_url
+    server = ThreadingHTTPServer(("0.0.0.0", port), WebhookHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="webhook-receiver").start()
+    print(f"Listening for Sentry webhooks on :{port}{WEBHOOK_PATH} with {workers} workers")
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    last_requeue = last_sweep = 0
+    try:
+        while True:
+            now = time.time()
+            if now - last_requeue >= HEARTBEAT_SECONDS:
+                requeued = job_queue.requeue_stale(timeout=stale_timeout)
+                if requeued:
+                    print(f"Requeued {requeued} jobs from lost workers")
+                last_requeue = now
+            if now - last_sweep >= blobstore.BLOB_SWEEP_INTERVAL:
+                try:
+                    blobstore.collect_garbage()
+                except Exception as e:
+                    print(f"Blob sweep failed: {e}")
+                last_sweep = now
+            if stopping.wait(SUPERVISE_SECONDS):
+                break
+            for i, process in enumerate(processes):
+                if process.is_alive():
+                    continue
+                # Its job will never finish; give it back to the queue right away
+                requeued = job_queue.requeue_stale(worker=f"worker-{i}")
+                print(f"worker-{i} exited with code {process.exitcode}; restarting it"
+                      + (" and requeued its job" if requeued else ""))
+                processes[i] = _start_worker(i, metrics_port)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(timeout=30)
+
+
+def replay(path: str, url: str, resource: str):
+    """POST a recorded webhook payload to a receiver, signed like Sentry would"""
+    with open(path, "rb") as f:
+        body = f.read()
+    request = urllib.request.Request(url, data=body, method="POST", headers={
+        "Content-Type": "application/json",
+        "Sentry-Hook-Resource": resource,
+        "Sentry-Hook-Timestamp": str(int(time.time())),
+        "Sentry-Hook-Signature": sign_payload(body, os.getenv("SENTRY_CLIENT_SECRET", "")),
+    })
+    try:
+        with urllib.request.urlopen(request) as response:
+            print(response.status, response.read().decode("utf-8"))
+    except urllib.error.HTTPError as e:
+        print(e.code, e.read().decode("utf-8"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless BugHunter webhook service")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run the webhook receiver and worker pool")
+    serve_parser.add_argument("--port", type=int, default=int(os.getenv("BUGHUNTER_WEBHOOK_PORT", "8080")))
+    serve_parser.add_argument("--workers", type=int, default=2)
+    serve_parser.add_argument("--stale-timeout", type=float, default=900,
+                              help="seconds without a heartbeat before a 'running' job is requeued")
+    serve_parser.add_argument("--metrics-port", type=int, default=int(os.getenv("BUGHUNTER_WORKER_METRICS_PORT", "0")),
+                              help="worker i serves Prometheus metrics on this port + i (0: off)")
+    replay_parser = commands.add_parser("replay", help="send a recorded webhook payload")
+    replay_parser.add_argument("payload")
+    replay_parser.add_argument("--url", default=f"http://localhost:8080{WEBHOOK_PATH}")
+    replay_parser.add_argument("--resource", default="event_alert")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args.port, args.workers, args.stale_timeout, args.metrics_port)
+    else:
+        replay(args.payload, args.url, args.resource)
+
+
+if __name__ == "__main__":
+    main()